@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import websockets
+
+import protocol
+from bot import Strategy
+
+# Banco de carga: arranca el servidor en un subproceso (o usa uno ya arrancado
+# con --url), abre N bots en /ws con la estrategia de bot.py sin el sleep de 2
+# segundos y M visores en /ws/web, y mide:
+#   - ida y vuelta de cada movimiento (p50/p95/p99)
+#   - retraso de los visores: hora de llegada del delta menos su "ts"
+#   - mensajes por segundo de bots y visores
+#   - CPU y memoria (RSS) del proceso del servidor, leídos de /proc
+# Los resultados se guardan en JSON para comparar entre versiones.
+
+
+class Stats:
+    def __init__(self):
+        self.measuring = False
+        self.rtts = []          # segundos
+        self.lags = []          # segundos
+        self.moves = 0
+        self.deaths = 0
+        self.errors = 0
+        self.viewer_messages = 0
+        self.viewer_bytes = 0
+        self.snapshots = 0
+        self.bot_disconnects = 0
+        self.viewer_disconnects = 0     # p. ej. visores lentos desconectados por el servidor
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(values):
+    # Milisegundos
+    return {
+        "count": len(values),
+        "mean": 1000 * sum(values) / len(values) if values else 0.0,
+        "p50": 1000 * percentile(values, 50),
+        "p95": 1000 * percentile(values, 95),
+        "p99": 1000 * percentile(values, 99),
+        "max": 1000 * max(values, default=0.0),
+    }
+
+
+# --- Servidor ---
+
+def start_server(port, env, log):
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                             "--log-level", "warning"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+def fetch_json(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.load(response)
+
+
+def wait_ready(http_url, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return fetch_json(http_url + "/stats")
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def cpu_seconds(pid):
+    # utime + stime del proceso (campos 14 y 15 de /proc/<pid>/stat)
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def rss_bytes(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+async def sample_rss(pid, samples, interval=0.5):
+    while True:
+        try:
+            samples.append(rss_bytes(pid))
+        except OSError:
+            return
+        await asyncio.sleep(interval)
+
+
+# --- Clientes ---
+
+async def run_bot(index, ws_url, rate, binary, width, height, stats, stop):
+    interval = 1.0 / rate if rate > 0 else 0.0
+    subprotocols = [protocol.SUBPROTOCOL] if binary else None
+    generation = 0
+    while not stop.is_set():
+        # Cada vida del bot es una conexión nueva: el servidor cierra /ws al morir
+        strategy = Strategy(f"bench{index}-{generation}", width=width, height=height, verbose=False)
+        generation += 1
+        try:
+            async with websockets.connect(ws_url, subprotocols=subprotocols, max_size=None) as websocket:
+                next_send = time.perf_counter()
+                while not stop.is_set():
+                    data = strategy.message()
+                    start = time.perf_counter()
+                    await websocket.send(protocol.encode_move(data) if binary else json.dumps(data))
+                    message = await websocket.recv()
+                    rtt = time.perf_counter() - start
+                    response = protocol.decode_response(message, data['x'], data['y']) if binary else json.loads(message)
+                    if stats.measuring:
+                        stats.rtts.append(rtt)
+                        stats.moves += 1
+                    if "error" in response:
+                        stats.errors += stats.measuring
+                    elif not response.get("positions"):
+                        stats.deaths += stats.measuring
+                        break
+                    strategy.update(response)
+                    if interval:
+                        next_send += interval
+                        await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+                    else:
+                        await asyncio.sleep(0)
+        except (OSError, websockets.ConnectionClosed):
+            stats.bot_disconnects += 1
+            await asyncio.sleep(0.1)
+
+
+def delta_ts(message, binary):
+    # Devuelve (es_delta, ts)
+    if binary:
+        if message[0] != protocol.MSG_DELTA:
+            return False, None
+        offset = protocol.DELTA_HEADER.size
+        (count,) = protocol.LENGTH.unpack_from(message, offset)
+        offset += protocol.LENGTH.size + count * protocol.CELL_RECORD.size
+        (length,) = protocol.LENGTH.unpack_from(message, offset)
+        tail = json.loads(message[offset + protocol.LENGTH.size:]) if length else {}
+        return True, tail.get("ts")
+    data = json.loads(message)
+    if data.get("type") != "delta":
+        return False, None
+    return True, data.get("ts")
+
+
+async def run_viewer(web_url, binary, stats, stop):
+    url = web_url + ("?proto=bin" if binary else "")
+    while not stop.is_set():
+        try:
+            async with websockets.connect(url, max_size=None) as websocket:
+                while not stop.is_set():
+                    try:
+                        message = await asyncio.wait_for(websocket.recv(), 0.5)
+                    except asyncio.TimeoutError:
+                        continue
+                    received = time.time()
+                    is_delta, ts = delta_ts(message, binary)
+                    if not stats.measuring:
+                        continue
+                    stats.viewer_messages += 1
+                    stats.viewer_bytes += len(message)
+                    if not is_delta:
+                        stats.snapshots += 1
+                    elif ts is not None:
+                        stats.lags.append(received - ts)
+        except (OSError, websockets.ConnectionClosed):
+            stats.viewer_disconnects += 1
+            await asyncio.sleep(0.1)
+
+
+# --- Ejecución ---
+
+async def run(args, pid, base_url):
+    ws_base = base_url.replace("http", "ws", 1)
+    stats = Stats()
+    stop = asyncio.Event()
+    binary = args.protocol == "bin"
+    tasks = [asyncio.create_task(run_viewer(ws_base + "/ws/web", binary, stats, stop))
+             for _ in range(args.viewers)]
+    tasks += [asyncio.create_task(run_bot(i, ws_base + "/ws", args.rate, binary, args.width, args.height, stats, stop))
+              for i in range(args.bots)]
+
+    await asyncio.sleep(args.warmup)
+    rss = []
+    sampler = asyncio.create_task(sample_rss(pid, rss)) if pid else None
+    cpu_start = cpu_seconds(pid) if pid else None
+    start = time.perf_counter()
+    stats.measuring = True
+    await asyncio.sleep(args.duration)
+    stats.measuring = False
+    elapsed = time.perf_counter() - start
+    cpu_end = cpu_seconds(pid) if pid else None
+
+    stop.set()
+    if sampler is not None:
+        sampler.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    try:
+        server_stats = await asyncio.to_thread(fetch_json, base_url + "/stats")
+    except OSError:
+        server_stats = None
+    return {
+        "elapsed": elapsed,
+        "moves": stats.moves,
+        "moves_per_second": stats.moves / elapsed,
+        "deaths": stats.deaths,
+        "errors": stats.errors,
+        "bot_disconnects": stats.bot_disconnects,
+        "viewer_disconnects": stats.viewer_disconnects,
+        "rtt_ms": summarize(stats.rtts),
+        "viewer_lag_ms": summarize(stats.lags),
+        "viewer_messages": stats.viewer_messages,
+        "viewer_messages_per_second": stats.viewer_messages / elapsed,
+        "viewer_bytes_per_second": stats.viewer_bytes / elapsed,
+        "viewer_snapshots": stats.snapshots,
+        "server": {
+            "cpu_percent": 100 * (cpu_end - cpu_start) / elapsed if pid else None,
+            "rss_max_bytes": max(rss, default=None),
+            "rss_end_bytes": rss[-1] if rss else None,
+            "stats": server_stats,
+        },
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banco de carga para /ws y /ws/web")
+    parser.add_argument("--bots", type=int, default=8)
+    parser.add_argument("--viewers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0, help="movimientos por segundo por bot (0 = sin límite)")
+    parser.add_argument("--duration", type=float, default=10.0, help="segundos de medición")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--protocol", choices=["json", "bin"], default="json")
+    parser.add_argument("--width", type=int, default=int(os.getenv("FIELD_WIDTH", "10")))
+    parser.add_argument("--height", type=int, default=int(os.getenv("FIELD_HEIGHT", "10")))
+    parser.add_argument("--tick-rate", type=float, default=float(os.getenv("TICK_RATE", "0")))
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="usar un servidor ya arrancado (p. ej. http://localhost:8000)")
+    parser.add_argument("--pid", type=int, help="pid del servidor de --url, para medir CPU y memoria")
+    parser.add_argument("--server-log", default=os.devnull, help="fichero para la salida del servidor")
+    parser.add_argument("--out", default="benchmark.json", help="fichero JSON de resultados")
+    args = parser.parse_args()
+
+    server = None
+    tmp = None
+    log = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+        pid = args.pid
+    else:
+        # Récords y registro de eventos en un directorio temporal para no tocar los del juego
+        tmp = tempfile.TemporaryDirectory()
+        env = dict(os.environ, FIELD_WIDTH=str(args.width), FIELD_HEIGHT=str(args.height),
+                   TICK_RATE=str(args.tick_rate),
+                   RECORDS_FILE=os.path.join(tmp.name, "records.json"),
+                   RECORDS_LOG=os.path.join(tmp.name, "records.log"),
+                   EVENTLOG_DIR=os.path.join(tmp.name, "events"))
+        # Sin límites de ritmo ni descarte por carga (salvo que se pidan) para
+        # medir el rendimiento bruto
+        for name in ("RATE_LIMIT_BOT", "RATE_LIMIT_CONNECTION", "LOAD_SHED_LAG"):
+            env.setdefault(name, "0")
+        log = open(args.server_log, "w")
+        server = start_server(args.port, env, log)
+        base_url = f"http://127.0.0.1:{args.port}"
+        pid = server.pid
+    try:
+        wait_ready(base_url)
+        results = asyncio.run(run(args, pid, base_url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if log is not None:
+            log.close()
+        if tmp is not None:
+            tmp.cleanup()
+
+    report = {"revision": git_revision(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "config": vars(args), "results": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    rtt, lag, srv = results["rtt_ms"], results["viewer_lag_ms"], results["server"]
+    print(f"{args.bots} bots, {args.viewers} visores, {args.protocol}, {results['elapsed']:.1f} s")
+    print(f"Movimientos: {results['moves_per_second']:.0f}/s  ida y vuelta p50 {rtt['p50']:.2f} ms, "
+          f"p95 {rtt['p95']:.2f} ms, p99 {rtt['p99']:.2f} ms")
+    print(f"Visores: {results['viewer_messages_per_second']:.0f} mensajes/s  retraso p50 {lag['p50']:.2f} ms, "
+          f"p95 {lag['p95']:.2f} ms, p99 {lag['p99']:.2f} ms")
+    if srv["cpu_percent"] is not None:
+        print(f"Servidor: CPU {srv['cpu_percent']:.0f}%, RSS máx {(srv['rss_max_bytes'] or 0) / 2**20:.1f} MiB")
+    print(f"Muertes {results['deaths']}, errores {results['errors']}, desconexiones de bots {results['bot_disconnects']}, "
+          f"de visores {results['viewer_disconnects']}")
+    print(f"Resultados en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,102 +4,195 @@ import json
 import random
 import os
 
+import protocol
+
+# Tamaño del campo (debe coincidir con el del servidor)
+FIELD_WIDTH = int(os.getenv("FIELD_WIDTH", "10"))
+FIELD_HEIGHT = int(os.getenv("FIELD_HEIGHT", "10"))
+
+# Protocolo: "json" (por defecto) o "bin" para el protocolo binario compacto
+BOT_PROTOCOL = os.getenv("BOT_PROTOCOL", "json")
+
+# Flota: con FLEET_SIZE > 1 se lanzan tantos bots por una sola conexión, con
+# nicknames FLEET_PREFIX + número
+FLEET_SIZE = int(os.getenv("FLEET_SIZE", "1"))
+FLEET_PREFIX = os.getenv("FLEET_PREFIX", "orion")
+
+# Estrategia del bot, separada del transporte para poder usarla también en la
+# simulación sin red (simulate.py). Con rng se puede fijar la semilla.
+class Strategy:
+    def __init__(self, nickname="orion", x=None, y=None, width=FIELD_WIDTH, height=FIELD_HEIGHT,
+                 rng=None, verbose=True):
+        self.rng = rng or random.Random()
+        self.width = width
+        self.height = height
+        self.nickname = nickname
+        self.energy = 10  # Energía inicial
+        self.energy_threshold = 10  # Umbral para custodiar comida
+        
+        # Posición inicial aleatoria
+        self.x = x if x is not None else self.rng.randint(0, width - 1)
+        self.y = y if y is not None else self.rng.randint(0, height - 1)
+        
+        self.known_foods = set()  # recordar posiciones de comida vistas
+        self.current_direction = (1, 0)  # Dirección inicial: derecha (dx, dy)
+        self.verbose = verbose
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def message(self):
+        # Datos a enviar en el próximo paso
+        return {
+            "x": self.x,
+            "y": self.y,
+            "nickname": self.nickname,
+            "energy": self.energy,
+            "remembered": list(self.known_foods)
+        }
+
+    def update(self, response):
+        # Procesa la respuesta del servidor y elige la siguiente posición
+        x, y = self.x, self.y
+        known_foods = self.known_foods
+        
+        # Actualizar energía
+        if 'energy' in response:
+            self.energy = response['energy']
+        
+        # Si hay positions disponibles, elegir movimiento
+        if "positions" in response and response["positions"]:
+            positions_list = response["positions"]
+            
+            # Encontrar comidas visibles
+            foods = [pos for pos in positions_list if pos['content'] and pos['content']['type'] == 'food']
+            
+            # Actualizar memoria de comidas
+            for f in foods:
+                known_foods.add((f['x'], f['y']))
+            
+            # Remover comidas recordadas que ya no existen (si el bot está en esa posición y no la ve)
+            if (x, y) in known_foods and not any(f['x'] == x and f['y'] == y for f in foods):
+                known_foods.discard((x, y))
+            
+            candidates = [pos for pos in positions_list if (pos['content'] is None or pos['content']['type'] == 'food') and abs(pos['x'] - x) <= 1 and abs(pos['y'] - y) <= 1 and not (pos['x'] == x and pos['y'] == y)]
+            if not candidates:
+                self.log("No hay movimientos disponibles")
+                return
+            
+            # Encontrar el objetivo más cercano: visible o recordado
+            all_targets = known_foods | {(f['x'], f['y']) for f in foods}
+            if all_targets:
+                closest = min(all_targets, key=lambda p: abs(p[0] - x) + abs(p[1] - y))
+                cx, cy = closest
+                dist_to_closest = abs(cx - x) + abs(cy - y)
+                
+                # Verificar si es visible
+                is_visible = any(f['x'] == cx and f['y'] == cy for f in foods)
+                
+                if is_visible and self.energy > self.energy_threshold and dist_to_closest <= 3:
+                    # Custodiar: moverse aleatoriamente alrededor de la comida
+                    self.log(f"Custodiando comida en ({cx}, {cy}) - moviendo alrededor")
+                    new_pos = self.rng.choice(candidates)
+                else:
+                    # Ir hacia el objetivo más cercano
+                    new_pos = min(candidates, key=lambda p: abs(p['x'] - cx) + abs(p['y'] - cy))
+                    self.log(f"Yendo a comida en ({cx}, {cy}) {'visible' if is_visible else 'recordada'}")
+            else:
+                # No hay objetivos: modo supervivencia - explorar sistemáticamente
+                current_direction = self.current_direction
+                preferred = [pos for pos in candidates if pos['x'] - x == current_direction[0] and pos['y'] - y == current_direction[1]]
+                if preferred:
+                    new_pos = self.rng.choice(preferred)
+                    self.log(f"Explorando en dirección {current_direction}")
+                else:
+                    new_pos = self.rng.choice(candidates)
+                    # Actualizar dirección al movimiento elegido
+                    self.current_direction = (new_pos['x'] - x, new_pos['y'] - y)
+                    self.log(f"Cambiando dirección a {self.current_direction}")
+            
+            # Actualizar posición
+            self.x = max(0, min(self.width - 1, new_pos['x']))
+            self.y = max(0, min(self.height - 1, new_pos['y']))
+        else:
+            self.log("No hay posiciones disponibles, manteniendo posición")
+
 async def bot():
     # Usar variable de entorno para la URL del WebSocket, por defecto localhost
     ws_url = os.getenv("WEBSOCKET_URL", "ws://localhost:8000/ws")
-    nickname = "orion"
-    energy = 10  # Energía inicial
-    energy_threshold = 10  # Umbral para custodiar comida
-    
-    # Posición inicial aleatoria
-    x = random.randint(0, 9)
-    y = random.randint(0, 9)
+    strategy = Strategy()
     
-    known_foods = set()  # recordar posiciones de comida vistas
-    current_direction = (1, 0)  # Dirección inicial: derecha (dx, dy)
-    
-    async with websockets.connect(ws_url) as websocket:
+    binary = BOT_PROTOCOL == "bin"
+    subprotocols = [protocol.SUBPROTOCOL] if binary else None
+    async with websockets.connect(ws_url, subprotocols=subprotocols) as websocket:
         while True:
             # Enviar datos actuales
-            data = {
-                "x": x,
-                "y": y,
-                "nickname": nickname,
-                "energy": energy,
-                "remembered": list(known_foods)
-            }
-            await websocket.send(json.dumps(data))
+            data = strategy.message()
+            if binary:
+                await websocket.send(protocol.encode_move(data))
+            else:
+                await websocket.send(json.dumps(data))
             print(f"Enviado: {data}")
             
             # Recibir respuesta
             response_str = await websocket.recv()
-            response = json.loads(response_str)
+            if binary:
+                response = protocol.decode_response(response_str, data['x'], data['y'])
+            else:
+                response = json.loads(response_str)
             print(f"Recibido: {response}")
             
-            # Actualizar energía
-            if 'energy' in response:
-                energy = response['energy']
+            strategy.update(response)
             
-            # Si hay positions disponibles, elegir movimiento
-            if "positions" in response and response["positions"]:
-                positions_list = response["positions"]
-                
-                # Encontrar comidas visibles
-                foods = [pos for pos in positions_list if pos['content'] and pos['content']['type'] == 'food']
-                
-                # Actualizar memoria de comidas
-                for f in foods:
-                    known_foods.add((f['x'], f['y']))
-                
-                # Remover comidas recordadas que ya no existen (si el bot está en esa posición y no la ve)
-                if (x, y) in known_foods and not any(f['x'] == x and f['y'] == y for f in foods):
-                    known_foods.discard((x, y))
-                
-                candidates = [pos for pos in positions_list if (pos['content'] is None or pos['content']['type'] == 'food') and abs(pos['x'] - x) <= 1 and abs(pos['y'] - y) <= 1 and not (pos['x'] == x and pos['y'] == y)]
-                if not candidates:
-                    print("No hay movimientos disponibles")
-                    await asyncio.sleep(2)
-                    continue
-                
-                # Encontrar el objetivo más cercano: visible o recordado
-                all_targets = known_foods | {(f['x'], f['y']) for f in foods}
-                if all_targets:
-                    closest = min(all_targets, key=lambda p: abs(p[0] - x) + abs(p[1] - y))
-                    cx, cy = closest
-                    dist_to_closest = abs(cx - x) + abs(cy - y)
-                    
-                    # Verificar si es visible
-                    is_visible = any(f['x'] == cx and f['y'] == cy for f in foods)
-                    
-                    if is_visible and energy > energy_threshold and dist_to_closest <= 3:
-                        # Custodiar: moverse aleatoriamente alrededor de la comida
-                        print(f"Custodiando comida en ({cx}, {cy}) - moviendo alrededor")
-                        new_pos = random.choice(candidates)
-                    else:
-                        # Ir hacia el objetivo más cercano
-                        new_pos = min(candidates, key=lambda p: abs(p['x'] - cx) + abs(p['y'] - cy))
-                        print(f"Yendo a comida en ({cx}, {cy}) {'visible' if is_visible else 'recordada'}")
+            # Esperar 2 segundos
+            await asyncio.sleep(2)
+
+async def fleet(size=FLEET_SIZE):
+    # Varios bots por una sola conexión: cada paso envía un lote con los
+    # movimientos de todos los bots vivos y recibe todas las respuestas juntas
+    ws_url = os.getenv("WEBSOCKET_URL", "ws://localhost:8000/ws")
+    strategies = [Strategy(f"{FLEET_PREFIX}{i}", verbose=False) for i in range(size)]
+    
+    binary = BOT_PROTOCOL == "bin"
+    subprotocols = [protocol.SUBPROTOCOL] if binary else None
+    async with websockets.connect(ws_url, subprotocols=subprotocols, max_size=None) as websocket:
+        while strategies:
+            moves = [strategy.message() for strategy in strategies]
+            if binary:
+                await websocket.send(protocol.encode_batch([protocol.encode_move(data) for data in moves]))
+            else:
+                await websocket.send(json.dumps({"batch": moves}))
+            
+            message = await websocket.recv()
+            if binary:
+                if message[0] == protocol.MSG_ERROR:
+                    responses = {"error": message[1:].decode('utf-8')}
                 else:
-                    # No hay objetivos: modo supervivencia - explorar sistemáticamente
-                    preferred = [pos for pos in candidates if pos['x'] - x == current_direction[0] and pos['y'] - y == current_direction[1]]
-                    if preferred:
-                        new_pos = random.choice(preferred)
-                        print(f"Explorando en dirección {current_direction}")
-                    else:
-                        new_pos = random.choice(candidates)
-                        # Actualizar dirección al movimiento elegido
-                        current_direction = (new_pos['x'] - x, new_pos['y'] - y)
-                        print(f"Cambiando dirección a {current_direction}")
-                
-                # Actualizar posición
-                x, y = new_pos['x'], new_pos['y']
-                x = max(0, min(9, x))
-                y = max(0, min(9, y))
+                    responses = [protocol.decode_response(m, data['x'], data['y'])
+                                 for m, data in zip(protocol.decode_batch(message), moves)]
             else:
-                print("No hay posiciones disponibles, manteniendo posición")
+                responses = json.loads(message)
+                responses = responses.get("batch", responses)
+            if isinstance(responses, dict):
+                print(f"Error: {responses.get('error')}")
+                break
+            
+            alive = []
+            for strategy, response in zip(strategies, responses):
+                if "error" in response:
+                    print(f"{strategy.nickname}: {response['error']}")
+                elif not response.get("positions"):
+                    print(f"{strategy.nickname} murió")
+                    continue
+                strategy.update(response)
+                alive.append(strategy)
+            strategies = alive
+            print(f"Flota: {len(strategies)} bots vivos, energía media "
+                  f"{sum(s.energy for s in strategies) / len(strategies) if strategies else 0:.1f}")
             
             # Esperar 2 segundos
             await asyncio.sleep(2)
 
 if __name__ == "__main__":
-    asyncio.run(bot())
\ No newline at end of file
+    asyncio.run(fleet() if FLEET_SIZE > 1 else bot())
@@ -0,0 +1,35 @@
+# Caché de mensajes serializados para los visores. Cada mensaje se construye
+# una sola vez por versión del mundo y se reutiliza (los mismos bytes) para
+# todos los visores y reconexiones que lo pidan en esa versión. Al cambiar la
+# versión se descarta todo lo anterior.
+_MISSING = object()
+
+
+class PayloadCache:
+    def __init__(self):
+        self.version = None
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, key, build):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+        payload = self.entries.get(key, _MISSING)
+        if payload is _MISSING:
+            self.misses += 1
+            payload = self.entries[key] = build()
+        else:
+            self.hits += 1
+        return payload
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "version": self.version,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
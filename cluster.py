@@ -0,0 +1,280 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+
+from protocol import LENGTH
+from world import Changes
+
+logger = logging.getLogger(__name__)
+
+# Modo multi-proceso: un único proceso de motor guarda el mundo y aplica las
+# reglas; varios procesos front-end (workers de uvicorn) atienden los
+# WebSockets. Se comunican por un socket Unix:
+#   - front-end -> motor: peticiones {"id", "op", ...} (movimientos, récords, stats)
+#   - motor -> front-end: respuestas {"op": "reply", "id", ...}, el estado
+#     completo al conectar ({"op": "state"}) y una actualización por versión
+#     del mundo con todas las celdas que cambiaron ({"op": "update"})
+# Cada front-end mantiene una réplica del campo ya renderizado y construye a
+# partir de ella los snapshots y deltas de sus propios visores.
+#
+# Cada trama es: longitud total (uint32), longitud de la cabecera (uint32),
+# cabecera JSON y un cuerpo binario opcional (respuestas del protocolo binario).
+
+# Bytes pendientes de envío tolerados por front-end antes de desconectarlo
+IPC_MAX_BUFFER = int(os.getenv("IPC_MAX_BUFFER", str(16 * 1024 * 1024)))
+
+
+def encode_frame(header, body=b''):
+    data = json.dumps(header).encode('utf-8')
+    return LENGTH.pack(LENGTH.size + len(data) + len(body)) + LENGTH.pack(len(data)) + data + body
+
+
+async def read_frame(reader):
+    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    frame = await reader.readexactly(length)
+    (header_length,) = LENGTH.unpack_from(frame)
+    header = json.loads(frame[LENGTH.size:LENGTH.size + header_length])
+    return header, frame[LENGTH.size + header_length:]
+
+
+# Réplica del campo renderizado en un front-end
+class Replica:
+    def __init__(self):
+        self.version = 0
+        self.cells = {}        # (x, y): celda renderizada (sólo las no vacías)
+        self.energy = {}       # nickname: energía
+        self.remembered = {}   # nickname: [[x, y], ...]
+        self.record = {}
+        self.ready = False     # True tras recibir el primer estado completo
+
+    def load(self, state):
+        # Estado completo; devuelve un Changes con full=True para los visores
+        self.version = state["version"]
+        self.cells = {(x, y): cell for x, y, cell in state["cells"]}
+        self.energy = dict(state["energies"])
+        self.remembered = dict(state["remembered"])
+        self.record = state["record"]
+        self.ready = True
+        changes = Changes(self.version, set(), set(), set(), False, True)
+        changes.time = state["ts"]
+        return changes
+
+    def apply(self, update):
+        # Aplica una actualización y la devuelve como Changes
+        cells = set()
+        for x, y, cell in update.get("cells", ()):
+            if cell == '.':
+                self.cells.pop((x, y), None)
+            else:
+                self.cells[(x, y)] = cell
+            cells.add((x, y))
+        for nick, value in update.get("energies", {}).items():
+            if value is None:
+                self.energy.pop(nick, None)
+            else:
+                self.energy[nick] = value
+        for nick, value in update.get("remembered", {}).items():
+            if value is None:
+                self.remembered.pop(nick, None)
+            else:
+                self.remembered[nick] = value
+        if "record" in update:
+            self.record = update["record"]
+        self.version = update["version"]
+        changes = Changes(self.version, cells, set(update.get("energies", ())),
+                          set(update.get("remembered", ())), "record" in update, False)
+        changes.time = update["ts"]
+        return changes
+
+    def cell(self, x, y):
+        return self.cells.get((x, y), '.')
+
+    def cells_in(self, x0, y0, w, h):
+        # Celdas no vacías dentro del rectángulo: (x, y, celda)
+        if len(self.cells) < w * h:
+            for (x, y), cell in self.cells.items():
+                if x0 <= x < x0 + w and y0 <= y < y0 + h:
+                    yield x, y, cell
+            return
+        for y in range(y0, y0 + h):
+            for x in range(x0, x0 + w):
+                cell = self.cells.get((x, y))
+                if cell is not None:
+                    yield x, y, cell
+
+
+# --- Proceso de motor ---
+
+class EngineServer:
+    def __init__(self, path, handle, state, update):
+        self.path = path
+        self.handle = handle    # corrutina(petición) -> (cabecera, cuerpo)
+        self.state = state      # fn() -> estado completo
+        self.update = update    # fn(changes) -> actualización
+        self.writers = set()
+        self.replies = set()    # tareas de respuesta en curso (el loop sólo guarda referencias débiles)
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._serve, self.path)
+        logger.info(f"Engine listening on {self.path}")
+
+    def broadcast(self, changes):
+        # Se llama en cada publicación del mundo; la trama se construye una vez
+        # y se escribe a todos los front-ends sin esperar a la red
+        if not self.writers:
+            return
+        frame = encode_frame(dict(self.state(), op="state") if changes.full else self.update(changes))
+        for writer in list(self.writers):
+            if writer.transport.get_write_buffer_size() > IPC_MAX_BUFFER:
+                # Front-end atascado: al reconectar recibirá el estado completo
+                logger.warning("Disconnecting front-end with a full IPC buffer")
+                self.writers.discard(writer)
+                writer.close()
+                continue
+            writer.write(frame)
+
+    async def _serve(self, reader, writer):
+        logger.info(f"Front-end connected ({len(self.writers) + 1} total)")
+        writer.write(encode_frame(dict(self.state(), op="state")))
+        self.writers.add(writer)
+        try:
+            while True:
+                request, _ = await read_frame(reader)
+                task = asyncio.create_task(self._reply(writer, request))
+                self.replies.add(task)
+                task.add_done_callback(self.replies.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+            logger.info(f"Front-end disconnected ({len(self.writers)} left)")
+
+    async def _reply(self, writer, request):
+        try:
+            header, body = await self.handle(request)
+        except Exception as e:
+            logger.exception(f"Failed to handle {request.get('op')} from front-end")
+            header, body = {"error": str(e)}, b''
+        if writer in self.writers:
+            writer.write(encode_frame(dict(header, op="reply", id=request["id"]), body))
+
+
+# --- Front-ends ---
+
+class EngineClient:
+    def __init__(self, path, replica, on_changes):
+        self.path = path
+        self.replica = replica
+        self.on_changes = on_changes  # fn(changes) con cada estado o actualización
+        self.writer = None
+        self.pending = {}             # id: futuro
+        self.ids = itertools.count(1)
+        self.connected = asyncio.Event()
+
+    async def run(self):
+        # Conecta (y reconecta) con el motor y procesa lo que envía
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(0.2)
+                continue
+            logger.info(f"Connected to engine at {self.path}")
+            try:
+                while True:
+                    header, body = await read_frame(reader)
+                    op = header.pop("op")
+                    if op == "reply":
+                        future = self.pending.pop(header.pop("id"), None)
+                        if future is not None and not future.done():
+                            future.set_result((header, body))
+                    elif op == "update":
+                        self.on_changes(self.replica.apply(header))
+                    elif op == "state":
+                        self.on_changes(self.replica.load(header))
+                        self.connected.set()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("Lost connection to engine, reconnecting")
+            self.connected.clear()
+            self.writer.close()
+            self.writer = None
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("engine connection lost"))
+            self.pending.clear()
+            await asyncio.sleep(0.2)
+
+    async def request(self, op, **fields):
+        await self.connected.wait()
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(encode_frame(dict(fields, op=op, id=request_id)))
+        return await future
+
+
+# --- Arranque ---
+
+async def run_engine(path):
+    # Proceso de motor: el mundo de main.py sin servidor HTTP
+    import main
+    await main.startup_event()
+    server = EngineServer(path, main.handle_engine_request, main.full_state, main.full_update)
+    main.listeners.append(server.broadcast)
+    await server.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        server.server.close()
+        await main.shutdown_event()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor con un proceso de motor y varios front-ends")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="procesos front-end")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", help="socket Unix del motor (por defecto, en un directorio temporal)")
+    parser.add_argument("--engine", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.engine:
+        asyncio.run(run_engine(args.socket))
+        return
+
+    tmp = None
+    if args.socket is None:
+        tmp = tempfile.TemporaryDirectory()
+        args.socket = os.path.join(tmp.name, "engine.sock")
+    engine = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--engine", "--socket", args.socket],
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        import uvicorn
+        # Los workers heredan ENGINE_SOCKET y arrancan main.py en modo front-end
+        os.environ["ENGINE_SOCKET"] = args.socket
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_level="warning")
+    finally:
+        engine.send_signal(signal.SIGTERM)
+        engine.wait()
+        if tmp is not None:
+            tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
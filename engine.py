@@ -0,0 +1,295 @@
+import logging
+import random
+import time
+
+import protocol
+from timerwheel import TimerWheel
+from vision import Vision
+
+logger = logging.getLogger(__name__)
+
+# Comida inicial y regeneración
+FOOD_VALUE = 5
+FOOD_MAX = 15           # no se regenera comida por encima de este número
+REMEMBERED_MAX = 1000   # comidas recordadas que puede enviar un bot en un movimiento
+NICKNAME_MAX = 255      # bytes UTF-8 de un nickname (el event log guarda la longitud en un byte)
+
+
+def parse_regions(text):
+    # Regiones de aparición de comida: "x,y,w,h:peso;x,y,w,h:peso;..." (el
+    # peso es opcional, 1 por defecto). Devuelve [(x, y, w, h, peso)].
+    regions = []
+    for part in filter(None, (p.strip() for p in text.split(";"))):
+        rect, _, weight = part.partition(":")
+        x, y, w, h = (int(v) for v in rect.split(","))
+        regions.append((x, y, w, h, float(weight or 1)))
+    return regions
+
+
+# Reglas del juego sobre un World, sin red ni asyncio: validación del
+# movimiento, consumo de comida, gasto de energía, muerte y visión. El servidor
+# lo usa con el reloj real; la simulación (simulate.py) lo avanza a mano con un
+# reloj de ticks.
+class Engine:
+    def __init__(self, world, clock=time.time, on_death=None, rng=None, stages=None,
+                 food_max=FOOD_MAX, food_density=0.0, food_regions=None, idle_timeout=0.0,
+                 vision_radius=2, vectorized_vision=False):
+        self.world = world
+        self.clock = clock          # fn() -> segundos; mide la supervivencia
+        self.on_death = on_death    # fn(nickname, duration, start_energy) -> True si es récord
+        self.rng = rng or random
+        # Política de aparición de comida: máximo absoluto (0 = sin límite),
+        # máximo como fracción de las celdas del campo (0 = sin límite) y
+        # regiones con peso [(x, y, w, h, peso)] (None = todo el campo)
+        cells = world.width * world.height
+        self.food_limit = food_max if food_max > 0 else cells
+        if food_density > 0:
+            self.food_limit = min(self.food_limit, int(food_density * cells))
+        # Cada región lleva su propio índice de celdas libres en el mundo: [(región, peso)]
+        self.food_regions = None
+        if food_regions:
+            self.food_regions = [(region, weight) for region, weight in
+                                 ((world.add_region(x, y, w, h), weight) for x, y, w, h, weight in food_regions)
+                                 if region is not None]
+        # Bots inactivos: cada movimiento reprograma el plazo del bot en una rueda
+        # de temporizadores y evict_idle quita los que llevan idle_timeout
+        # segundos sin moverse (0 = nunca)
+        self.idle_timeout = idle_timeout
+        self.liveness = None
+        if idle_timeout > 0:
+            self.liveness = TimerWheel(tick=idle_timeout / 16, slots=64, now=clock())
+        # Celdas que ve cada bot alrededor de su posición (ver vision.py)
+        self.vision = Vision(world, vision_radius, vectorized_vision)
+        # Histogramas opcionales {"rules": h, "vision": h} (ver metrics.py) para
+        # el tiempo de las reglas y el del cálculo de la visión
+        self.stages = stages
+        if world.width == world.height:
+            self.out_of_range = f"Coordenadas fuera de rango 0-{world.width - 1}"
+        else:
+            self.out_of_range = f"Coordenadas fuera de rango x 0-{world.width - 1}, y 0-{world.height - 1}"
+
+    def move(self, data, start_energy=10, binary=False):
+        # Devuelve (respuesta, muerto)
+        result = self._apply(data, start_energy, binary)
+        if result is not None:
+            return result
+        start = time.perf_counter() if self.stages is not None else 0.0
+        x, y = data['x'], data['y']
+        codes, values = self.vision.see(x, y)
+        response = self.vision.response(x, y, self.world.energy[data['nickname']], codes, values, binary)
+        if self.stages is not None:
+            self.stages["vision"].observe(time.perf_counter() - start)
+        return response, False
+
+    def move_many(self, calls):
+        # Aplica varios movimientos [(datos, energía inicial, binario)] seguidos,
+        # en orden, y después calcula de una vez la visión de los bots que siguen
+        # vivos (con el mundo tal como queda tras todo el lote). Devuelve la
+        # lista de (respuesta, muerto). Todos los movimientos se validan antes
+        # de aplicar ninguno; los que no son válidos reciben su error y no
+        # cambian nada.
+        errors = [self.validate(data) for data, _, _ in calls]
+        results = []
+        seeing = []     # (índice, x, y, energía, binario)
+        for (data, start_energy, binary), error in zip(calls, errors):
+            if error is not None:
+                result = {"error": error}, False
+            else:
+                try:
+                    result = self._apply(data, start_energy, binary)
+                except Exception:
+                    # Un fallo inesperado afecta sólo a su movimiento
+                    logger.exception("Move failed: %r", data)
+                    result = {"error": "Error interno"}, False
+            if result is None:
+                seeing.append((len(results), data['x'], data['y'], self.world.energy[data['nickname']], binary))
+            results.append(result)
+        if seeing:
+            start = time.perf_counter() if self.stages is not None else 0.0
+            views = self.vision.see_many([(x, y) for _, x, y, _, _ in seeing])
+            for (n, x, y, energy, binary), (codes, values) in zip(seeing, views):
+                results[n] = self.vision.response(x, y, energy, codes, values, binary), False
+            if self.stages is not None:
+                self.stages["vision"].observe(time.perf_counter() - start)
+        return results
+
+    def move_batch(self, moves, start_energy=10, binary=False):
+        # Varios movimientos con la misma energía inicial y formato (ver move_many).
+        # Quien llama publica una sola vez al terminar.
+        return self.move_many([(data, start_energy, binary) for data in moves])
+
+    def _apply(self, data, start_energy, binary):
+        # Reglas de un movimiento. Devuelve (respuesta, muerto) si el movimiento
+        # no es válido o el bot murió, o None si sigue vivo y falta su visión.
+        start = time.perf_counter() if self.stages is not None else 0.0
+        world = self.world
+        # Validar todo antes de tocar el mundo: un movimiento se aplica entero o no se aplica
+        error = self.validate(data)
+        if error is not None:
+            return {"error": error}, False
+        x = data['x']
+        y = data['y']
+        nickname = data['nickname']
+
+        # Asignar color si es nuevo
+        if nickname not in world.colors:
+            world.add_bot(nickname, x, y, start_energy, self.clock())
+            logger.info("Assigned color %s to new nickname %s with %s energy", world.colors[nickname], nickname, start_energy)
+        # Actualizar posición
+        world.move_bot(nickname, x, y)
+        if self.liveness is not None:
+            self.liveness.schedule(nickname, self.clock() + self.idle_timeout)
+
+        # Actualizar comidas recordadas
+        world.set_remembered(nickname, set(tuple(pos) for pos in data.get("remembered", [])))
+
+        consumed = False
+        # Consumir comida objetivo si especificada
+        if 'target_food' in data:
+            tx, ty = data['target_food']
+            if world.in_bounds(tx, ty):
+                value = world.take_food(tx, ty)
+                if value:
+                    world.set_energy(nickname, world.energy[nickname] + value)
+                    consumed = True
+                    logger.debug("%s consumed target food at (%s, %s), energy +%s", nickname, tx, ty, value)
+
+        # Consumir comida si hay en la posición (por si acaso)
+        value = world.take_food(x, y)
+        if value:
+            world.set_energy(nickname, world.energy[nickname] + value)
+            consumed = True
+            logger.debug("%s consumed food at (%s, %s), energy +%s", nickname, x, y, value)
+
+        # Perder energía solo si no consumió
+        if not consumed:
+            world.set_energy(nickname, world.energy[nickname] - 1)
+        if world.energy[nickname] <= 0:
+            self.kill(nickname, start_energy)
+            if self.stages is not None:
+                self.stages["rules"].observe(time.perf_counter() - start)
+            if binary:
+                return protocol.encode_dead(), True
+            return {"positions": [], "energy": 0}, True
+        if self.stages is not None:
+            self.stages["rules"].observe(time.perf_counter() - start)
+        return None
+
+    def validate(self, data):
+        # Devuelve el mensaje de error del movimiento, o None si es válido
+        if not isinstance(data, dict):
+            return "Datos inválidos"
+        world = self.world
+        x = data.get('x')
+        y = data.get('y')
+        if not (isinstance(x, int) and isinstance(y, int) and self._is_nickname(data.get('nickname'))):
+            logger.debug("Invalid data: %r", data)
+            return "Datos inválidos"
+        if not world.in_bounds(x, y):
+            logger.debug("Out of range coordinates: x=%s, y=%s", x, y)
+            return self.out_of_range
+        remembered = data.get('remembered', [])
+        if not (isinstance(remembered, (list, tuple)) and len(remembered) <= REMEMBERED_MAX
+                and all(self._is_cell(pos) for pos in remembered)):
+            logger.debug("Invalid remembered: %r", remembered)
+            return "Datos inválidos"
+        # target_food fuera del campo se ignora, pero tiene que ser un par de enteros
+        target = data.get('target_food', (0, 0))
+        if not (isinstance(target, (list, tuple)) and len(target) == 2
+                and isinstance(target[0], int) and isinstance(target[1], int)):
+            logger.debug("Invalid target_food: %r", target)
+            return "Datos inválidos"
+        return None
+
+    def _is_nickname(self, nickname):
+        # Texto no vacío de hasta NICKNAME_MAX bytes en UTF-8
+        if not isinstance(nickname, str) or not nickname:
+            return False
+        try:
+            return len(nickname.encode('utf-8')) <= NICKNAME_MAX
+        except UnicodeEncodeError:
+            return False  # Surrogates sueltos (p. ej. "\ud800" en el JSON)
+
+    def _is_cell(self, pos):
+        # Par [x, y] de enteros dentro del campo
+        return (isinstance(pos, (list, tuple)) and len(pos) == 2
+                and isinstance(pos[0], int) and isinstance(pos[1], int) and self.world.in_bounds(pos[0], pos[1]))
+
+    def kill(self, nickname, start_energy=10):
+        world = self.world
+        # Calcular tiempo de vida
+        now = self.clock()
+        duration = now - world.start_times.get(nickname, now)
+        start_energy = world.start_energies.get(nickname, start_energy)
+        if self.on_death is not None and self.on_death(nickname, duration, start_energy):
+            world.mark_record()
+            logger.info("New record: %s survived %.2f seconds", nickname, duration)
+        # Remover bot del juego
+        world.remove_bot(nickname)
+        if self.liveness is not None:
+            self.liveness.cancel(nickname)
+        logger.info("%s died due to low energy", nickname)
+        return duration
+
+    def touch_all(self):
+        # Da a todos los bots del mundo un plazo nuevo (p. ej. los restaurados al
+        # arrancar, que tienen que volver a moverse para no ser expulsados)
+        if self.liveness is not None:
+            deadline = self.clock() + self.idle_timeout
+            for nickname in self.world.positions:
+                self.liveness.schedule(nickname, deadline)
+
+    def evict_idle(self):
+        # Quita los bots cuyo plazo venció (sin contar como muerte) y devuelve
+        # sus nicknames. Sólo recorre los plazos vencidos.
+        if self.liveness is None:
+            return []
+        evicted = [nickname for nickname in self.liveness.advance(self.clock())
+                   if nickname in self.world.bot_ids]
+        for nickname in evicted:
+            self.world.remove_bot(nickname)
+        if evicted:
+            logger.info("Evicted %d idle bots (no moves in %ss)", len(evicted), self.idle_timeout)
+        return evicted
+
+    # --- Comida ---
+
+    def seed_food(self, count):
+        # Comida inicial en las primeras celdas, fila a fila
+        world = self.world
+        for i in range(min(count, world.width * world.height)):
+            world.add_food(i % world.width, i // world.width, FOOD_VALUE)
+
+    def scatter_food(self, count):
+        # Comida en celdas aleatorias (se ignoran las ocupadas)
+        world = self.world
+        for _ in range(count):
+            world.add_food(self.rng.randint(0, world.width - 1), self.rng.randint(0, world.height - 1), FOOD_VALUE)
+
+    def spawn_food(self, count=1):
+        # Regenera hasta count comidas en celdas libres sin pasar del límite;
+        # devuelve cuántas colocó
+        world = self.world
+        placed = 0
+        for _ in range(min(count, self.food_limit - len(world.food_cells))):
+            cell = self._spawn_cell()
+            if cell is None:
+                break  # Campo (o todas las regiones) lleno
+            world.add_food(cell[0], cell[1], FOOD_VALUE)
+            placed += 1
+        if placed:
+            logger.debug("Regenerated %d foods", placed)
+        return placed
+
+    def _spawn_cell(self):
+        # Una celda libre uniforme del índice de celdas libres (O(1)). Con
+        # regiones se elige antes una según su peso entre las que aún tienen
+        # sitio, así que sólo falla si no queda ninguna celda libre en ellas.
+        world = self.world
+        if self.food_regions is None:
+            return world.random_free_cell(self.rng)
+        regions = [(region, weight) for region, weight in self.food_regions if world.free_in_region(region)]
+        if not regions:
+            return None
+        region = self.rng.choices([r for r, _ in regions], [w for _, w in regions])[0]
+        return world.random_free_cell(self.rng, region)
@@ -0,0 +1,351 @@
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+# Registro de eventos del mundo: cada cambio aplicado (alta, movimiento,
+# energía, comidas recordadas, comida nueva o consumida, muerte, reinicio y
+# cierre de versión) se añade en binario a un log. El log se divide en
+# segmentos: cada segmento NNNNNN.log empieza con un snapshot NNNNNN.snap
+# (JSON con World.state()) del mundo en ese momento. Para arrancar se carga el
+# último snapshot y se reproduce la cola de su log; para ver una partida pasada
+# se reproduce desde un snapshot cualquiera.
+#
+# Registros (little-endian), todos empiezan con un byte de tipo:
+EV_COMMIT = 1       # versión, hora
+EV_JOIN = 2         # id, x, y, energía inicial, hora de inicio, nickname
+EV_MOVE = 3         # id, x, y
+EV_ENERGY = 4       # id, energía
+EV_REMEMBERED = 5   # id, número de puntos, puntos
+EV_FOOD = 6         # x, y, valor
+EV_TAKE = 7         # x, y
+EV_LEAVE = 8        # id
+EV_RESET = 9
+
+COMMIT = struct.Struct('<BId')
+JOIN = struct.Struct('<BIiiidB')
+MOVE = struct.Struct('<BIii')
+ENERGY = struct.Struct('<BIi')
+REMEMBERED = struct.Struct('<BIH')
+POINT = struct.Struct('<ii')
+FOOD = struct.Struct('<BiiH')
+TAKE = struct.Struct('<Bii')
+LEAVE = struct.Struct('<BI')
+RESET = struct.Struct('<B')
+
+
+class EventLog:
+    def __init__(self, directory="events", snapshot_every=100000, snapshot_interval=300.0,
+                 keep=20, flush_interval=1.0):
+        self.directory = directory
+        self.snapshot_every = snapshot_every        # registros antes de un snapshot nuevo
+        self.snapshot_interval = snapshot_interval  # segundos máximos entre snapshots
+        self.keep = keep                            # segmentos que se conservan
+        self.flush_interval = flush_interval
+        self.segment = 0
+        self.buffer = bytearray()   # registros aún no escritos
+        self.records = 0            # registros en el segmento actual
+        self.file = None
+
+    # --- Registro (lo llama World) ---
+
+    def commit(self, version, now):
+        self.buffer += COMMIT.pack(EV_COMMIT, version, now)
+        self.records += 1
+
+    def join(self, bot_id, nickname, x, y, start_energy, now):
+        # Engine.validate limita los nicknames a NICKNAME_MAX bytes: nunca se recortan
+        name = nickname.encode('utf-8')
+        self.buffer += JOIN.pack(EV_JOIN, bot_id, x, y, start_energy, now, len(name)) + name
+        self.records += 1
+
+    def move(self, bot_id, x, y):
+        self.buffer += MOVE.pack(EV_MOVE, bot_id, x, y)
+        self.records += 1
+
+    def energy(self, bot_id, value):
+        self.buffer += ENERGY.pack(EV_ENERGY, bot_id, value)
+        self.records += 1
+
+    def remembered(self, bot_id, cells):
+        # El registro se construye entero antes de añadirlo, para no dejar uno
+        # a medias en el buffer si algún punto no se puede empaquetar
+        cells = list(cells)
+        record = REMEMBERED.pack(EV_REMEMBERED, bot_id, len(cells)) + b''.join(POINT.pack(px, py) for px, py in cells)
+        self.buffer += record
+        self.records += 1
+
+    def food(self, x, y, value):
+        self.buffer += FOOD.pack(EV_FOOD, x, y, value)
+        self.records += 1
+
+    def take(self, x, y):
+        self.buffer += TAKE.pack(EV_TAKE, x, y)
+        self.records += 1
+
+    def leave(self, bot_id):
+        self.buffer += LEAVE.pack(EV_LEAVE, bot_id)
+        self.records += 1
+
+    def reset(self):
+        self.buffer += RESET.pack(EV_RESET)
+        self.records += 1
+
+    # --- Segmentos ---
+
+    def open(self, world):
+        # Restaura el mundo desde el último segmento (si lo hay) y empieza uno
+        # nuevo a partir del estado resultante
+        os.makedirs(self.directory, exist_ok=True)
+        segments = list_segments(self.directory)
+        if segments:
+            self.segment = segments[-1]
+            start = time.perf_counter()
+            try:
+                state = load_snapshot(segment_path(self.directory, self.segment, "snap"))
+                if (state["width"], state["height"]) != (world.width, world.height):
+                    logger.warning(f"Not restoring {self.directory}: field size changed")
+                else:
+                    count = replay_into(world, state, segment_path(self.directory, self.segment, "log"))
+                    logger.info(f"Restored world version {world.version} from segment {self.segment} "
+                                f"({count} events) in {time.perf_counter() - start:.3f}s")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not restore from segment {self.segment}: {e}")
+        world.events = self
+        self.rotate(world)
+
+    def rotate(self, world):
+        # Cierra el segmento actual y abre uno nuevo con un snapshot del mundo
+        data, records, segment, state = self._cut(world)
+        if self.file is not None:
+            _write(self.file, data)
+        self._switch(records, segment, self._write_segment(segment, state))
+
+    def _cut(self, world):
+        # En el event loop: separa los registros del segmento actual y toma el
+        # snapshot del siguiente en el mismo instante, para que sean coherentes.
+        # El segmento actual sigue abierto hasta que el nuevo esté escrito.
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        state = world.state()
+        state["time"] = time.time()
+        return data, self.records, self.segment + 1, state
+
+    def _switch(self, records, segment, file):
+        # El segmento nuevo ya está en disco: pasar a él
+        old, self.file = self.file, file
+        self.segment = segment
+        self.records -= records
+        if old is not None:
+            old.close()
+
+    def _write_segment(self, segment, state):
+        # Fuera del event loop: escribe el snapshot y abre el log nuevo (que
+        # devuelve). El snapshot sólo aparece cuando el log ya está abierto, así
+        # que si algo falla el segmento actual sigue siendo el último válido.
+        tmp = segment_path(self.directory, segment, "snap.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        file = open(segment_path(self.directory, segment, "log"), "ab")
+        try:
+            os.replace(tmp, segment_path(self.directory, segment, "snap"))
+        except OSError:
+            file.close()
+            raise
+        for old_segment in list_segments(self.directory)[:-self.keep]:
+            for ext in ("snap", "log"):
+                try:
+                    os.unlink(segment_path(self.directory, old_segment, ext))
+                except FileNotFoundError:
+                    pass
+        logger.debug(f"Started event log segment {segment}")
+        return file
+
+    def flush(self):
+        if self.buffer and self.file is not None:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer.clear()
+
+    async def flush_async(self):
+        # Como flush, con la escritura en un hilo
+        if not self.buffer or self.file is None:
+            return
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        await self._write_async(data)
+
+    async def _write_async(self, data):
+        # Escribe data en el log actual desde un hilo; si falla, vuelve al buffer
+        if self.file is None:
+            return
+        try:
+            await asyncio.to_thread(_write, self.file, data)
+        except OSError:
+            self.buffer[:0] = data  # Reintentar en la próxima pasada
+            raise
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    async def run(self, world):
+        # El snapshot se toma en el event loop; serializarlo y escribirlo (y el
+        # log) se hace en un hilo para no bloquear el juego
+        last_snapshot = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                if self.records >= self.snapshot_every or (
+                        self.records and time.monotonic() - last_snapshot >= self.snapshot_interval):
+                    # Si algo falla se sigue en el segmento actual y se reintenta
+                    # en la próxima pasada (los registros siguen contando)
+                    data, records, segment, state = self._cut(world)
+                    await self._write_async(data)
+                    self._switch(records, segment, await asyncio.to_thread(self._write_segment, segment, state))
+                    last_snapshot = time.monotonic()
+                else:
+                    await self.flush_async()
+            except OSError as e:
+                logger.warning(f"Event log write failed: {e}")
+
+
+def _write(file, data):
+    file.write(data)
+    file.flush()
+
+
+# --- Lectura ---
+
+def segment_path(directory, segment, ext):
+    return os.path.join(directory, f"{segment:06d}.{ext}")
+
+
+def list_segments(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-5]) for name in names if name.endswith(".snap") and name[:-5].isdigit())
+
+
+def load_snapshot(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_events(path):
+    # Recorre el log con mmap; devuelve tuplas (tipo, campos...). Un registro
+    # cortado al final (crash a mitad de escritura) se ignora.
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            try:
+                while offset < size:
+                    kind = data[offset]
+                    if kind == EV_COMMIT:
+                        _, version, now = COMMIT.unpack_from(data, offset)
+                        offset += COMMIT.size
+                        yield kind, version, now
+                    elif kind == EV_JOIN:
+                        _, bot_id, x, y, start_energy, now, length = JOIN.unpack_from(data, offset)
+                        offset += JOIN.size
+                        if offset + length > size:
+                            return
+                        nickname = data[offset:offset + length].decode('utf-8', 'replace')
+                        offset += length
+                        yield kind, bot_id, nickname, x, y, start_energy, now
+                    elif kind == EV_MOVE:
+                        _, bot_id, x, y = MOVE.unpack_from(data, offset)
+                        offset += MOVE.size
+                        yield kind, bot_id, x, y
+                    elif kind == EV_ENERGY:
+                        _, bot_id, value = ENERGY.unpack_from(data, offset)
+                        offset += ENERGY.size
+                        yield kind, bot_id, value
+                    elif kind == EV_REMEMBERED:
+                        _, bot_id, count = REMEMBERED.unpack_from(data, offset)
+                        offset += REMEMBERED.size
+                        if offset + count * POINT.size > size:
+                            return
+                        cells = {POINT.unpack_from(data, offset + i * POINT.size) for i in range(count)}
+                        offset += count * POINT.size
+                        yield kind, bot_id, cells
+                    elif kind == EV_FOOD:
+                        _, x, y, value = FOOD.unpack_from(data, offset)
+                        offset += FOOD.size
+                        yield kind, x, y, value
+                    elif kind == EV_TAKE:
+                        _, x, y = TAKE.unpack_from(data, offset)
+                        offset += TAKE.size
+                        yield kind, x, y
+                    elif kind == EV_LEAVE:
+                        _, bot_id = LEAVE.unpack_from(data, offset)
+                        offset += LEAVE.size
+                        yield kind, bot_id
+                    elif kind == EV_RESET:
+                        offset += RESET.size
+                        yield (kind,)
+                    else:
+                        logger.warning(f"Unknown event type {kind} at {path}:{offset}")
+                        return
+            except struct.error:
+                return  # Registro incompleto al final
+
+
+def apply_event(world, event):
+    # Aplica un evento leído del log; devuelve los Changes si es un cierre de versión
+    kind = event[0]
+    if kind == EV_COMMIT:
+        changes = world.commit()
+        world.version = event[1]
+        if changes is not None:
+            changes.version = event[1]
+            changes.time = event[2]
+        return changes
+    if kind == EV_JOIN:
+        _, bot_id, nickname, x, y, start_energy, now = event
+        world._next_id = bot_id
+        world.add_bot(nickname, x, y, start_energy, now)
+    elif kind == EV_MOVE:
+        world.move_bot(world.nicknames[event[1]], event[2], event[3])
+    elif kind == EV_ENERGY:
+        world.set_energy(world.nicknames[event[1]], event[2])
+    elif kind == EV_REMEMBERED:
+        world.set_remembered(world.nicknames[event[1]], event[2])
+    elif kind == EV_FOOD:
+        world.add_food(event[1], event[2], event[3])
+    elif kind == EV_TAKE:
+        world.take_food(event[1], event[2])
+    elif kind == EV_LEAVE:
+        world.remove_bot(world.nicknames[event[1]])
+    elif kind == EV_RESET:
+        world.reset()
+    return None
+
+
+def replay_into(world, state, log_path):
+    # Carga un snapshot y reproduce su log completo; devuelve los eventos aplicados
+    world.restore(state)
+    events, world.events = world.events, None
+    count = 0
+    try:
+        for event in read_events(log_path):
+            apply_event(world, event)
+            count += 1
+    except FileNotFoundError:
+        pass
+    finally:
+        world.events = events
+    world.commit()  # Descartar los cambios pendientes de la reproducción
+    return count
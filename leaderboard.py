@@ -0,0 +1,163 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+# Tabla de récords en memoria: los mejores tiempos de supervivencia por energía
+# inicial. Las escrituras no bloquean el juego: cada entrada nueva se encola y
+# una tarea de fondo la añade a un log (una línea JSON por entrada, con fsync).
+# Cada cierto tiempo el log se compacta en el fichero de récords con una
+# escritura atómica (fichero temporal + os.replace) y se vacía. Al arrancar se
+# carga el fichero compactado y se reproducen las entradas del log posteriores.
+#
+# El fichero compactado mantiene en el nivel superior el mejor récord con el
+# formato antiguo de records.json ({"name", "time", "date", "start_energy"}).
+class Leaderboard:
+    def __init__(self, path="records.json", log_path="records.log", size=10,
+                 compact_every=100, compact_interval=60.0):
+        self.path = path
+        self.log_path = log_path
+        self.size = size                          # entradas por energía inicial
+        self.compact_every = compact_every        # entradas en el log antes de compactar
+        self.compact_interval = compact_interval  # segundos máximos entre compactaciones
+        self.best = {"name": "", "time": 0, "date": "", "start_energy": 0}
+        self.tops = {}      # start_energy: [entradas ordenadas de mayor a menor tiempo]
+        self.seq = 0        # número de la última entrada registrada
+        self.pending = []   # entradas aún no escritas en el log
+        self.log_entries = 0
+        self._saved_seq = 0
+        self._wakeup = None
+
+    # --- Memoria ---
+
+    def submit(self, name, duration, start_energy, date=None):
+        # Registra una muerte; devuelve True si es un nuevo récord absoluto
+        self.seq += 1
+        entry = {"seq": self.seq, "name": name, "time": duration,
+                 "date": date or datetime.now().isoformat(), "start_energy": start_energy}
+        is_best = self._insert(entry)
+        self.pending.append(entry)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return is_best
+
+    def _insert(self, entry):
+        top = self.tops.setdefault(entry["start_energy"], [])
+        keys = [-e["time"] for e in top]
+        top.insert(bisect.bisect_right(keys, -entry["time"]), entry)
+        del top[self.size:]
+        if entry["time"] > self.best["time"]:
+            # Se modifica en sitio: otros módulos guardan referencias a este dict
+            self.best.update(name=entry["name"], time=entry["time"], date=entry["date"],
+                             start_energy=entry["start_energy"])
+            return True
+        return False
+
+    def snapshot(self, start_energy=None):
+        if start_energy is not None:
+            return {"best": self.best, "tops": {str(start_energy): self.tops.get(start_energy, [])}}
+        return {"best": self.best, "tops": {str(k): v for k, v in sorted(self.tops.items())}}
+
+    # --- Disco ---
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable {self.path}: {e}")
+            data = {}
+        if data.get("name"):
+            self.best.update({k: data[k] for k in ("name", "time", "date", "start_energy") if k in data})
+        for energy, entries in data.get("leaderboard", {}).items():
+            self.tops[int(energy)] = entries[:self.size]
+        if not data.get("leaderboard") and data.get("name"):
+            # records.json antiguo: un único récord
+            self.tops[self.best["start_energy"]] = [dict(self.best, seq=0)]
+        self.seq = self._saved_seq = data.get("seq", 0)
+
+        # Reproducir el log; la última línea puede estar cortada si hubo un crash
+        try:
+            with open(self.log_path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            lines = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self.log_entries += 1
+            if entry["seq"] <= self._saved_seq:
+                continue  # Ya incluida en la compactación
+            self._insert(entry)
+            self.seq = max(self.seq, entry["seq"])
+        logger.info(f"Loaded leaderboard: {sum(len(t) for t in self.tops.values())} entries, {self.log_entries} in log")
+
+    def _append(self, entries):
+        with open(self.log_path, "a") as f:
+            f.write("".join(json.dumps(e) + "\n" for e in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self, data, seq):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        # Si hubo un crash entre el replace y este truncado, las entradas del
+        # log con seq <= seq se ignoran al cargar
+        with open(self.log_path, "w") as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            await asyncio.to_thread(self._append, batch)
+        except OSError:
+            self.pending[:0] = batch  # Reintentar en la próxima vuelta
+            raise
+        self.log_entries += len(batch)
+
+    async def compact(self):
+        await self.flush()
+        if self.seq == self._saved_seq and not self.log_entries:
+            return
+        data = dict(self.best, seq=self.seq,
+                    leaderboard={str(k): list(v) for k, v in self.tops.items()})
+        seq = self.seq
+        await asyncio.to_thread(self._compact, data, seq)
+        self._saved_seq = seq
+        self.log_entries = 0
+        logger.debug(f"Compacted leaderboard at seq {seq}")
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        last_compact = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.compact_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                if self.log_entries >= self.compact_every or (
+                        self.log_entries and time.monotonic() - last_compact >= self.compact_interval):
+                    await self.compact()
+                    last_compact = time.monotonic()
+            except OSError as e:
+                logger.warning(f"Leaderboard persistence failed: {e}")
@@ -1,15 +1,29 @@
 from fastapi import FastAPI, WebSocket, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
-from starlette.middleware.base import BaseHTTPMiddleware
 from colorama import Fore, Style, init
-from typing import List
+from typing import Dict, Optional
+from collections import deque
 import json
 import logging
 import time
-from datetime import datetime
 import asyncio
-import random
+import os
+import struct
+
+import protocol
+from cache import PayloadCache
+from cluster import EngineClient, Replica
+from engine import Engine, parse_regions
+from eventlog import EventLog
+import eventlog
+from leaderboard import Leaderboard
+import metrics
+from npc import NpcPool
+import ratelimit
+from ratelimit import RateLimiter, TokenBucket
+from scheduler import TickScheduler
+from world import Changes, World
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -17,415 +31,1052 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
-# Middleware para logging de todas las peticiones HTTP
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        logger.debug(f"HTTP Request: {request.method} {request.url} from {request.client.host if request.client else 'unknown'}")
-        response = await call_next(request)
-        logger.debug(f"HTTP Response: {response.status_code} for {request.method} {request.url}")
-        return response
-
-app.add_middleware(LoggingMiddleware)
+# Configuración del campo (por variables de entorno, como el bot)
+FIELD_WIDTH = int(os.getenv("FIELD_WIDTH", "10"))
+FIELD_HEIGHT = int(os.getenv("FIELD_HEIGHT", "10"))
+VIEWPORT_MAX = int(os.getenv("VIEWPORT_MAX", "64"))  # Lado máximo del viewport de un visor
+DEFAULT_VIEWPORT = (0, 0, min(FIELD_WIDTH, VIEWPORT_MAX), min(FIELD_HEIGHT, VIEWPORT_MAX))
+TRAIL_LENGTH = int(os.getenv("TRAIL_LENGTH", "10"))  # Celdas de rastro por bot (0 = sin rastro)
+MAX_BATCH = int(os.getenv("MAX_BATCH", "1000"))  # Movimientos máximos en un mensaje {"batch": [...]}
+# Aparición de comida: cada FOOD_SPAWN_INTERVAL segundos se colocan hasta
+# FOOD_SPAWN_BATCH comidas en celdas libres, sin pasar de FOOD_MAX comidas (0 =
+# sin límite) ni de FOOD_MAX_DENSITY (fracción de las celdas; 0 = sin límite).
+# FOOD_REGIONS="x,y,w,h:peso;..." limita la aparición a esas regiones.
+FOOD_SPAWN_INTERVAL = float(os.getenv("FOOD_SPAWN_INTERVAL", "35"))
+FOOD_SPAWN_BATCH = int(os.getenv("FOOD_SPAWN_BATCH", "1"))
+FOOD_MAX = int(os.getenv("FOOD_MAX", "15"))
+FOOD_MAX_DENSITY = float(os.getenv("FOOD_MAX_DENSITY", "0"))
+FOOD_REGIONS = parse_regions(os.getenv("FOOD_REGIONS", ""))
+# Segundos sin moverse tras los que un bot se quita del campo (0 = nunca)
+BOT_IDLE_TIMEOUT = float(os.getenv("BOT_IDLE_TIMEOUT", "10"))
+# Límites de ritmo (fichas por segundo y ráfaga; 0 = sin límite): por nickname
+# (movimientos, antes de aplicar las reglas) y por conexión a /ws o dirección
+# de cliente en POST /ws (mensajes). Con RATE_LIMIT_MODE=coalesce los mensajes
+# que superan el límite de una conexión /ws esperan ficha y el último sustituye
+# a los anteriores; con reject (por defecto) se rechazan al momento.
+RATE_LIMIT_BOT = float(os.getenv("RATE_LIMIT_BOT", "5"))
+RATE_LIMIT_BOT_BURST = float(os.getenv("RATE_LIMIT_BOT_BURST", "10"))
+RATE_LIMIT_CONNECTION = float(os.getenv("RATE_LIMIT_CONNECTION", "20"))
+RATE_LIMIT_CONNECTION_BURST = float(os.getenv("RATE_LIMIT_CONNECTION_BURST", "40"))
+RATE_LIMIT_MODE = os.getenv("RATE_LIMIT_MODE", "reject")
+# Control de admisión: con el event loop más de LOAD_SHED_LAG segundos por
+# detrás (ver metrics.LoopMonitor) se rechazan los movimientos nuevos (0 = nunca)
+LOAD_SHED_LAG = float(os.getenv("LOAD_SHED_LAG", "0.5"))
+# Visión de los bots: radio alrededor de su posición (por defecto 2, 5x5) y
+# cálculo con numpy de todas las visiones de un lote o tick en una pasada
+VISION_RADIUS = max(1, min(int(os.getenv("VISION_RADIUS", "2")), 255))
+VISION_VECTORIZED = os.getenv("VISION_VECTORIZED", "0") == "1"
+# NPC: bots del propio servidor con la estrategia de bot.py (ver npc.py).
+# NPC_COUNT bots con nicknames NPC_PREFIX + número que se mueven cada
+# NPC_INTERVAL segundos; sus estrategias se evalúan en NPC_WORKERS hilos o, con
+# NPC_POOL=process, procesos (0 = en el event loop)
+NPC_COUNT = int(os.getenv("NPC_COUNT", "0"))
+NPC_PREFIX = os.getenv("NPC_PREFIX", "npc")
+NPC_INTERVAL = float(os.getenv("NPC_INTERVAL", "2"))
+NPC_WORKERS = int(os.getenv("NPC_WORKERS", "0"))
+NPC_POOL = os.getenv("NPC_POOL", "thread")
+# Motor de ticks opcional: con TICK_RATE > 0 (en Hz) los movimientos se aplican
+# en lote una vez por tick y se publica una sola actualización por tick
+TICK_RATE = float(os.getenv("TICK_RATE", "0"))
+TICK_BUDGET_MS = float(os.getenv("TICK_BUDGET_MS", "0"))  # 0 = el periodo del tick
+# Récords: fichero compactado, log de escritura y entradas por energía inicial
+RECORDS_FILE = os.getenv("RECORDS_FILE", "records.json")
+RECORDS_LOG = os.getenv("RECORDS_LOG", "records.log")
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+# Envío a los visores: tamaño de la cola por visor, desbordamientos tolerados
+# dentro de una ventana antes de expulsarlo y tiempo máximo de un envío
+VIEWER_QUEUE_SIZE = int(os.getenv("VIEWER_QUEUE_SIZE", "32"))
+VIEWER_SEND_TIMEOUT = float(os.getenv("VIEWER_SEND_TIMEOUT", "5"))
+# Registro de eventos para reanudar la partida al reiniciar y reproducir
+# partidas pasadas (ver eventlog.py). EVENTLOG_DIR vacío lo desactiva.
+EVENTLOG_DIR = os.getenv("EVENTLOG_DIR", "events")
+EVENTLOG_SNAPSHOT_EVERY = int(os.getenv("EVENTLOG_SNAPSHOT_EVERY", "100000"))  # registros por segmento
+EVENTLOG_SNAPSHOT_INTERVAL = float(os.getenv("EVENTLOG_SNAPSHOT_INTERVAL", "300"))  # segundos
+EVENTLOG_KEEP = int(os.getenv("EVENTLOG_KEEP", "20"))  # segmentos conservados
+# Modo front-end (ver cluster.py): con ENGINE_SOCKET el mundo vive en el proceso
+# de motor y este proceso sólo atiende WebSockets y HTTP
+ENGINE_SOCKET = os.getenv("ENGINE_SOCKET")
+METRICS_LAG_INTERVAL = float(os.getenv("METRICS_LAG_INTERVAL", "0.25"))  # segundos entre medidas del retraso del loop
 
-# Estado del campo
-positions = {}  # nickname: (x, y)
-colors = {}     # nickname: color_name
-energy = {}     # nickname: int
-foods = []   # list of {'x': int, 'y': int, 'value': int}
-paths = {}      # nickname: list of [x, y]
-remembered = {}  # nickname: set of (x, y)
-available_colors = ['RED', 'GREEN', 'BLUE', 'YELLOW', 'MAGENTA', 'CYAN', 'TEAL', 'WHITE']
+# Métricas para /metrics (ver metrics.py). Etapas del camino caliente:
+#   parse: decodificar el mensaje de un bot; rules: reglas del movimiento;
+#   vision: calcular lo que ve el bot; grid: construir el grid de un snapshot;
+#   serialize: codificar un snapshot o delta; broadcast: repartir una versión
+#   a todos los visores (incluye construir y serializar sus deltas)
+registry = metrics.Registry()
+STAGES = ("parse", "rules", "vision", "grid", "serialize", "broadcast")
+stage_seconds = {stage: registry.histogram("botfield_stage_seconds", "Time spent in each hot-path stage", stage=stage)
+                 for stage in STAGES}
+moves_total = registry.counter("botfield_moves_total", "Bot moves applied (batched moves count one each)")
+broadcasts_total = registry.counter("botfield_broadcasts_total", "World versions broadcast to viewers")
+# Los mensajes JSON se serializan con ensure_ascii, así que caracteres = bytes
+bytes_out = {channel: registry.counter("botfield_bytes_out_total", "Bytes sent over WebSockets", channel=channel)
+             for channel in ("bots", "viewers")}
+messages_out = {channel: registry.counter("botfield_messages_out_total", "Messages sent over WebSockets", channel=channel)
+                for channel in ("bots", "viewers")}
+bot_connections = registry.gauge("botfield_bot_connections", "Open /ws connections")
+moves_rejected = {reason: registry.counter("botfield_moves_rejected_total", "Moves not applied by admission control",
+                                           reason=reason)
+                  for reason in (ratelimit.RATE_LIMITED, ratelimit.COALESCED, ratelimit.OVERLOADED)}
+loop_monitor = metrics.LoopMonitor(registry.histogram("botfield_event_loop_lag_seconds",
+                                                      "Extra delay of a periodic event loop wakeup"),
+                                   METRICS_LAG_INTERVAL)
 
-# Récord de tiempo
-record = {"name": "", "time": 0, "date": "", "start_energy": 0}
-start_times = {}  # nickname: start_time
-start_energies = {}  # nickname: start_energy
+# Estado del campo (posiciones, comida, energía, caminos, colores...)
+world = World(FIELD_WIDTH, FIELD_HEIGHT, TRAIL_LENGTH)
 
-# Tracking de actividad de bots
-last_bot_request_time = None
+# Récords de tiempo: tabla en memoria que se guarda en segundo plano.
+# record es el mejor récord absoluto (el dict se actualiza en sitio).
+leaderboard = Leaderboard(RECORDS_FILE, RECORDS_LOG, LEADERBOARD_SIZE)
+record = leaderboard.best
 
 # Inicializar colorama (para posibles logs futuros)
 init(autoreset=True)
 
-# Cargar récord si existe
-try:
-    with open("records.json", "r") as f:
-        record = json.load(f)
-except FileNotFoundError:
-    pass
-
 # Templates
 templates = Jinja2Templates(directory="templates")
 
-# Generar 15 comidas random al inicio
-import random
-foods = [f for f in foods if isinstance(f, dict)]  # Limpiar viejos tuples si existen
-foods = [{'x': i % 10, 'y': i // 10, 'value': 5} for i in range(15)]
+def submit_death(nickname, duration, start_energy):
+    # Los NPC no entran en los récords
+    if npcs is not None and nickname in npcs.nicknames:
+        return False
+    return leaderboard.submit(nickname, duration, start_energy)
+
+engine = Engine(world, on_death=submit_death, stages=stage_seconds,
+                food_max=FOOD_MAX, food_density=FOOD_MAX_DENSITY, food_regions=FOOD_REGIONS,
+                idle_timeout=BOT_IDLE_TIMEOUT, vision_radius=VISION_RADIUS,
+                vectorized_vision=VISION_VECTORIZED)
+bots_evicted = registry.counter("botfield_bots_evicted_total", "Bots removed after BOT_IDLE_TIMEOUT without moving")
+food_spawned = registry.counter("botfield_food_spawned_total", "Food items placed by regeneration")
+registry.gauge("botfield_food", "Food items on the field", lambda: len(world.food_cells))
+
+npcs = None
+if NPC_COUNT > 0 and not ENGINE_SOCKET:
+    npcs = NpcPool(engine, NPC_COUNT, NPC_PREFIX, NPC_INTERVAL, NPC_WORKERS, NPC_POOL == "process")
+    registry.gauge("botfield_npcs", "Server-side NPC bots", lambda: len(npcs.nicknames))
+    registry.counter("botfield_npc_steps_total", "NPC steps run", lambda: npcs.steps)
+    registry.counter("botfield_npc_deaths_total", "NPC deaths (replaced by new NPCs)", lambda: npcs.deaths)
+    registry.gauge("botfield_npc_step_seconds", "Duration of the last NPC step", lambda: npcs.last_duration)
+
+# Generar 15 comidas al inicio
+engine.seed_food(15)
+world.commit()
+
+# En modo front-end el estado que ven los visores es una réplica del motor
+replica = Replica() if ENGINE_SOCKET else None
+engine_client = None
+
+events = EventLog(EVENTLOG_DIR, EVENTLOG_SNAPSHOT_EVERY, EVENTLOG_SNAPSHOT_INTERVAL,
+                  EVENTLOG_KEEP) if EVENTLOG_DIR else None
+
+# Otros destinos de cada versión publicada (el servidor de front-ends del motor)
+listeners = []
 
 # Función para regenerar comida
 async def regenerate_food():
     while True:
-        await asyncio.sleep(35)
-        foods[:] = [f for f in foods if isinstance(f, dict)]  # Limpiar viejos tuples
-        if len(foods) < 15:
-            # Encontrar posición vacía
-            attempts = 0
-            while attempts < 100:  # Evitar loop infinito
-                x = random.randint(0, 9)
-                y = random.randint(0, 9)
-                pos = (x, y)
-                if not any(f.get('x') == x and f.get('y') == y for f in foods if isinstance(f, dict)) and pos not in positions.values():
-                    foods.append({'x': x, 'y': y, 'value': 5})
-                    logger.debug(f"Regenerated food at ({x}, {y})")
-                    break
-                attempts += 1
-
-# Iniciar regeneración en startup
+        await asyncio.sleep(FOOD_SPAWN_INTERVAL)
+        placed = engine.spawn_food(FOOD_SPAWN_BATCH)
+        if placed:
+            food_spawned.inc(placed)
+            await publish()
+
+# Iniciar regeneración (y el motor de ticks si está activo) en startup
 @app.on_event("startup")
 async def startup_event():
+    global engine_client
+    asyncio.create_task(loop_monitor.run())
+    if ENGINE_SOCKET:
+        # El motor se encarga de récords, comida y ticks
+        engine_client = EngineClient(ENGINE_SOCKET, replica, manager.broadcast)
+        asyncio.create_task(engine_client.run())
+        await engine_client.connected.wait()
+        return
+    # Cargar los récords fuera del event loop y arrancar su escritura en segundo plano
+    await asyncio.to_thread(leaderboard.load)
+    world.mark_record()
+    asyncio.create_task(leaderboard.run())
+    if events is not None:
+        # Reanudar la partida anterior (snapshot + cola del log) y seguir registrando
+        await asyncio.to_thread(events.open, world)
+        asyncio.create_task(events.run(world))
+    if engine.liveness is not None:
+        # Los bots restaurados tienen que volver a moverse para no ser expulsados
+        engine.touch_all()
+        asyncio.create_task(evict_idle_bots())
     asyncio.create_task(regenerate_food())
+    if scheduler is not None:
+        asyncio.create_task(scheduler.run())
+    if npcs is not None:
+        # Los NPC ceden el paso cuando el servidor descarta carga
+        npcs.start(submit_engine_step, overloaded)
+        logger.info("Started %d NPC bots (%s workers: %d)", NPC_COUNT, NPC_POOL, NPC_WORKERS)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if not ENGINE_SOCKET:
+        if npcs is not None:
+            npcs.close()
+        await leaderboard.compact()
+        if events is not None:
+            events.close()
 
-# Manager para conexiones WebSocket de la web
+# Visor conectado a /ws/web. Cada visor tiene su propia tarea de envío y una
+# cola acotada: si la cola se llena se descartan los deltas pendientes y se le
+# envía un snapshot nuevo (gana siempre el estado más reciente).
+class Viewer:
+    def __init__(self, websocket: WebSocket, viewport: tuple, binary: bool = False):
+        self.websocket = websocket
+        self.viewport = viewport     # (x, y, w, h)
+        self.binary = binary         # protocolo binario negociado
+        self.topics = TOPICS         # temas suscritos (ver select_topics)
+        self.bots = None             # bots cuyas comidas recordadas recibe (None = todos)
+        self.version = 0             # versión del último mensaje encolado
+        self.queue = deque()         # mensajes serializados pendientes de enviar
+        self.needs_snapshot = True   # el próximo envío es un snapshot
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+# Manager para conexiones WebSocket de la web.
+# Protocolo: al conectar (o al cambiar de viewport o pedir {"type": "resync"})
+# se envía un "snapshot" completo con la versión del mundo; después sólo se
+# envían "delta" con las celdas y energías que cambiaron. Cada delta lleva
+# "base" (la última versión que recibió ese visor) y "version"; si el cliente
+# detecta un salto entre su versión y "base" debe pedir un resync.
+# Con {"type": "subscribe", "topics": [...], "bots": [...]} el visor elige qué
+# temas recibe; un delta sin nada de sus temas no se le envía.
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.viewers: Dict[WebSocket, Viewer] = {}
+        self.slow_disconnects = 0  # visores expulsados por lentos
+        self.overflows = 0         # colas desbordadas (sustituidas por un snapshot)
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, binary: bool = False):
         client_info = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else "unknown"
-        logger.debug(f"Connecting WebSocket from {client_info}")
-        self.active_connections.append(websocket)
-        logger.info(f"Connected WebSocket from {client_info}. Total: {len(self.active_connections)}")
+        viewer = Viewer(websocket, clamp_viewport(DEFAULT_VIEWPORT), binary)
+        self.viewers[websocket] = viewer
+        logger.info("Connected WebSocket from %s. Total: %d", client_info, len(self.viewers))
         
-        # Enviar el grid actual al nuevo cliente
-        grid_data = {"grid": get_grid()}
-        await websocket.send_text(json.dumps(grid_data))
+        # La tarea de envío empieza mandando el snapshot actual al nuevo cliente
+        viewer.task = asyncio.create_task(self._sender(viewer))
+        viewer.wakeup.set()
+
+    async def set_viewport(self, websocket: WebSocket, viewport: tuple):
+        viewer = self.viewers[websocket]
+        viewer.viewport = clamp_viewport(viewport)
+        self._request_snapshot(viewer)
+
+    async def send_snapshot(self, websocket: WebSocket):
+        self._request_snapshot(self.viewers[websocket])
+
+    async def subscribe(self, websocket: WebSocket, topics: frozenset, bots: Optional[frozenset]):
+        # El snapshot siguiente trae el estado actual de los temas nuevos
+        viewer = self.viewers[websocket]
+        viewer.topics = topics
+        viewer.bots = bots
+        self._request_snapshot(viewer)
 
     def disconnect(self, websocket: WebSocket):
+        viewer = self.viewers.pop(websocket, None)
+        if viewer is None:
+            return  # Ya desconectado (por ejemplo, expulsado por lento)
+        if viewer.task is not None and viewer.task is not asyncio.current_task():
+            viewer.task.cancel()
+        logger.debug("Disconnected WebSocket from %s. Total: %d", websocket.client, len(self.viewers))
+
+    def broadcast(self, changes: Changes):
+        # Sólo serializa y encola: nunca espera a la red, así que quien publica
+        # (el handler de un bot o el tick) no se bloquea por un visor lento.
+        # Los visores con el mismo viewport y base comparten el mensaje.
+        start = time.perf_counter()
+        broadcasts_total.inc()
+        for viewer in list(self.viewers.values()):
+            if viewer.needs_snapshot:
+                continue  # El snapshot pendiente ya incluirá estos cambios
+            if changes.full:
+                self._request_snapshot(viewer)
+                continue
+            message = delta_payload(changes, viewer.viewport, viewer.version, viewer.binary, viewer.topics, viewer.bots)
+            if message is not None:
+                self._enqueue(viewer, message, changes.version)
+        stage_seconds["broadcast"].observe(time.perf_counter() - start)
+
+    def _request_snapshot(self, viewer: Viewer):
+        viewer.queue.clear()
+        viewer.needs_snapshot = True
+        viewer.wakeup.set()
+
+    def _enqueue(self, viewer: Viewer, message, version: int):
+        if len(viewer.queue) >= VIEWER_QUEUE_SIZE:
+            # Cola llena: descartar los deltas viejos y mandar el estado actual.
+            # No es motivo para desconectar: sólo se expulsa al visor si un envío
+            # (incluido ese snapshot) supera VIEWER_SEND_TIMEOUT.
+            self.overflows += 1
+            self._request_snapshot(viewer)
+            return
+        viewer.queue.append(message)
+        viewer.version = version
+        viewer.wakeup.set()
+
+    async def _sender(self, viewer: Viewer):
+        websocket = viewer.websocket
+        try:
+            while True:
+                await viewer.wakeup.wait()
+                viewer.wakeup.clear()
+                while True:
+                    if viewer.needs_snapshot:
+                        viewer.needs_snapshot = False
+                        viewer.queue.clear()
+                        viewer.version = current_version()
+                        message = snapshot_payload(viewer.viewport, viewer.binary, viewer.topics, viewer.bots)
+                    elif viewer.queue:
+                        message = viewer.queue.popleft()
+                    else:
+                        break
+                    if viewer.binary:
+                        await asyncio.wait_for(websocket.send_bytes(message), VIEWER_SEND_TIMEOUT)
+                    else:
+                        await asyncio.wait_for(websocket.send_text(message), VIEWER_SEND_TIMEOUT)
+                    bytes_out["viewers"].inc(len(message))
+                    messages_out["viewers"].inc()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self._drop_slow(viewer, f"send took longer than {VIEWER_SEND_TIMEOUT}s")
+        except Exception as e:
+            logger.debug("Failed to send to %s: %s", websocket.client, e)
+            self.disconnect(websocket)
+
+    def _drop_slow(self, viewer: Viewer, reason: str):
+        websocket = viewer.websocket
         client_info = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else "unknown"
-        logger.debug(f"Disconnecting WebSocket from {client_info}")
-        self.active_connections.remove(websocket)
-        logger.debug(f"Disconnected WebSocket from {client_info}. Total: {len(self.active_connections)}")
-
-    async def broadcast(self, message: str):
-        logger.debug(f"Broadcasting message to {len(self.active_connections)} connections: {message[:100]}...")
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                client_info = f"{connection.client.host}:{connection.client.port}" if connection.client else "unknown"
-                logger.debug(f"Failed to send to {client_info}: {e}")
-                disconnected.append(connection)
-        for conn in disconnected:
-            self.disconnect(conn)
+        logger.warning("Disconnecting slow viewer %s: %s", client_info, reason)
+        self.slow_disconnects += 1
+        self.disconnect(websocket)
+        asyncio.create_task(close_quietly(websocket))
 
 manager = ConnectionManager()
 
-def get_grid():
-    logger.debug("Generating grid")
-    grid = [['.' for _ in range(10)] for _ in range(10)]
-    for nick, (x, y) in positions.items():
-        color = colors[nick]
-        if nick == 'orion':
-            symbol = '🦖'
-        elif nick == 'Xenon':
-            symbol = '🗿'
+registry.gauge("botfield_viewers", "Open /ws/web connections", lambda: len(manager.viewers))
+registry.gauge("botfield_bots", "Bots alive in the world", lambda: len(world.positions))
+registry.gauge("botfield_world_version", "Current world version", lambda: current_version())
+registry.counter("botfield_slow_viewer_disconnects_total", "Viewers disconnected for being too slow",
+                 lambda: manager.slow_disconnects)
+registry.counter("botfield_viewer_queue_overflows_total", "Viewer queues that overflowed and were replaced by a snapshot",
+                 lambda: manager.overflows)
+registry.counter("botfield_payload_cache_hits_total", "Serialized viewer messages reused", lambda: payloads.hits)
+registry.counter("botfield_payload_cache_misses_total", "Serialized viewer messages built", lambda: payloads.misses)
+
+async def close_quietly(websocket: WebSocket):
+    try:
+        await asyncio.wait_for(websocket.close(code=1008), VIEWER_SEND_TIMEOUT)
+    except Exception:
+        pass
+
+# Mensajes serializados, construidos una vez por versión y compartidos
+payloads = PayloadCache()
+
+# Temas de los mensajes de visor y las claves de snapshot/delta de cada uno.
+# Las claves que no son de ningún tema (type, version, viewport, base, ts) van
+# siempre.
+TOPICS = frozenset(("grid", "energies", "record", "remembered"))
+TOPIC_KEYS = {"grid": "grid", "cells": "grid", "energies": "energies", "record": "record", "remembered": "remembered"}
+
+def select_topics(message, topics, bots):
+    # Sólo las partes del mensaje de los temas suscritos y, de "remembered",
+    # sólo las de los bots elegidos (bots=None: todos)
+    if topics is TOPICS and bots is None:
+        return message
+    result = {}
+    for key, value in message.items():
+        topic = TOPIC_KEYS.get(key)
+        if topic is None:
+            result[key] = value
+        elif topic in topics:
+            if key == "remembered" and bots is not None:
+                value = {nick: cells for nick, cells in value.items() if nick in bots}
+                if not value and message.get("type") != "snapshot":
+                    continue
+            result[key] = value
+    return result
+
+def snapshot_payload(viewport, binary, topics=TOPICS, bots=None):
+    def build():
+        # El snapshot completo se construye una vez por viewport y versión
+        snapshot = payloads.get(current_version(), ("snapshot", viewport), lambda: build_snapshot(viewport))
+        snapshot = select_topics(snapshot, topics, bots)
+        start = time.perf_counter()
+        message = protocol.encode_snapshot(snapshot) if binary else json.dumps(snapshot)
+        stage_seconds["serialize"].observe(time.perf_counter() - start)
+        return message
+    return payloads.get(current_version(), ("snapshot", viewport, binary, topics, bots), build)
+
+def delta_payload(changes, viewport, base, binary, topics=TOPICS, bots=None):
+    # None si los cambios no tocan nada de lo que ve ese viewport en sus temas
+    def build():
+        body = payloads.get(changes.version, ("delta", viewport), lambda: build_delta(changes, viewport))
+        if body is None:
+            return None
+        body = select_topics(body, topics, bots)
+        if not body:
+            return None
+        start = time.perf_counter()
+        delta = {"type": "delta", "version": changes.version, "base": base, "ts": changes.time, **body}
+        message = protocol.encode_delta(delta) if binary else json.dumps(delta)
+        stage_seconds["serialize"].observe(time.perf_counter() - start)
+        return message
+    return payloads.get(changes.version, ("delta", viewport, base, binary, topics, bots), build)
+
+def negotiate_binary(websocket: WebSocket):
+    # Protocolo binario si el cliente lo pide como subprotocolo o con ?proto=bin.
+    # Devuelve (binario, subprotocolo a aceptar)
+    if protocol.SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        return True, protocol.SUBPROTOCOL
+    return websocket.query_params.get("proto") == "bin", None
+
+def clamp_viewport(viewport):
+    # Recortar el viewport al campo y al tamaño máximo permitido
+    x, y, w, h = viewport
+    x = max(0, min(FIELD_WIDTH - 1, x))
+    y = max(0, min(FIELD_HEIGHT - 1, y))
+    w = max(1, min(VIEWPORT_MAX, FIELD_WIDTH - x, w))
+    h = max(1, min(VIEWPORT_MAX, FIELD_HEIGHT - y, h))
+    return (x, y, w, h)
+
+async def publish():
+    # Cerrar los cambios pendientes en una versión y enviarla a los visores
+    changes = world.commit()
+    if changes is not None:
+        manager.broadcast(changes)
+        for listener in listeners:
+            listener(changes)
+
+def current_version():
+    return replica.version if replica is not None else world.version
+
+def bot_symbol(nick):
+    if nick == 'orion':
+        return '🦖'
+    if nick == 'Xenon':
+        return '🗿'
+    return nick[0].upper()  # Primera letra del nickname
+
+# Las funciones de renderizado usan el mundo en vivo (o la réplica en modo
+# front-end) salvo que se les pase otro mundo en source (reproducciones)
+def render_cell(x, y, source=None):
+    if source is None:
+        if replica is not None:
+            return replica.cell(x, y)
+        source = world
+    if source.food_at(x, y):
+        return '🍌'
+    nick = source.bot_at(x, y)
+    if nick is not None:
+        return {"symbol": bot_symbol(nick), "color": source.colors[nick]}
+    # Rastros recientes con color tenue
+    if source.trail_at(x, y):
+        return {"symbol": "", "color": f"{source.colors.get(source.trail_owner(x, y), 'WHITE')}_dim"}
+    return '.'
+
+def rendered_cells(viewport, source=None):
+    # Celdas no vacías del viewport ya renderizadas: (x, y, celda)
+    x0, y0, w, h = viewport
+    if source is None:
+        if replica is not None:
+            yield from replica.cells_in(x0, y0, w, h)
+            return
+        source = world
+    for x, y, nick, food, owner in source.cells_in(x0, y0, w, h):
+        if food:
+            yield x, y, '🍌'
+        elif nick is not None:
+            yield x, y, {"symbol": bot_symbol(nick), "color": source.colors[nick]}
         else:
-            symbol = nick[0].upper()  # Primera letra del nickname
-        grid[y][x] = {"symbol": symbol, "color": color}
-    for f in foods:
-        if isinstance(f, dict):
-            grid[f['y']][f['x']] = '🍌'
-    
-    # Marcar caminos recorridos con color tenue
-    for nick, path in paths.items():
-        color = colors.get(nick, 'WHITE')
-        dim_color = f"{color}_dim"
-        for px, py in path:
-            if grid[py][px] == '.':
-                grid[py][px] = {"symbol": "", "color": dim_color}
-    
-    logger.debug(f"Grid generated with {len(positions)} positions and {len(foods)} foods")
+            # Rastros recientes con color tenue
+            yield x, y, {"symbol": "", "color": f"{source.colors.get(owner, 'WHITE')}_dim"}
+
+def get_grid(viewport=DEFAULT_VIEWPORT, source=None):
+    start = time.perf_counter()
+    x0, y0, w, h = viewport
+    grid = [['.' for _ in range(w)] for _ in range(h)]
+    for x, y, cell in rendered_cells(viewport, source):
+        grid[y - y0][x - x0] = cell
+    stage_seconds["grid"].observe(time.perf_counter() - start)
     return grid
 
-def reset_field():
-    global foods, positions, colors, energy, paths, start_times, start_energies, last_bot_request_time
-    foods = [{'x': i % 10, 'y': i // 10, 'value': 5} for i in range(10)]
-    positions.clear()
-    colors.clear()
-    energy.clear()
-    paths.clear()
-    start_times.clear()
-    start_energies.clear()
-    last_bot_request_time = None
-    logger.info("Campo reiniciado por inactividad")
-
-async def monitor_activity():
+def build_snapshot(viewport, source=None):
+    x, y, w, h = viewport
+    if source is not None:
+        # Reproducción: sin récord
+        return {
+            "type": "snapshot",
+            "version": source.version,
+            "grid": get_grid(viewport, source),
+            "viewport": {"x": x, "y": y, "w": w, "h": h},
+            "energies": dict(source.energy),
+            "remembered": {nick: list(rem) for nick, rem in source.remembered.items()},
+        }
+    if replica is not None:
+        return {
+            "type": "snapshot",
+            "version": replica.version,
+            "grid": get_grid(viewport),
+            "viewport": {"x": x, "y": y, "w": w, "h": h},
+            "energies": dict(replica.energy),
+            "record": replica.record,
+            "remembered": dict(replica.remembered),
+        }
+    return {
+        "type": "snapshot",
+        "version": world.version,
+        "grid": get_grid(viewport),
+        "viewport": {"x": x, "y": y, "w": w, "h": h},
+        "energies": dict(world.energy),
+        "record": record,
+        "remembered": {nick: list(rem) for nick, rem in world.remembered.items()},
+    }
+
+def build_delta(changes, viewport, source=None):
+    x0, y0, w, h = viewport
+    delta = {}
+    cells = [[x, y, render_cell(x, y, source)] for x, y in changes.cells if x0 <= x < x0 + w and y0 <= y < y0 + h]
+    if cells:
+        delta["cells"] = cells
+    if source is not None:
+        energies, remembered, current_record = source.energy, source.remembered, None
+    elif replica is not None:
+        energies, remembered, current_record = replica.energy, replica.remembered, replica.record
+    else:
+        energies, remembered, current_record = world.energy, world.remembered, record
+    if changes.energies:
+        # null para los bots que ya no están
+        delta["energies"] = {nick: energies.get(nick) for nick in changes.energies}
+    if changes.remembered:
+        delta["remembered"] = {nick: list(remembered[nick]) if nick in remembered else None for nick in changes.remembered}
+    if changes.record and current_record is not None:
+        delta["record"] = current_record
+    return delta or None
+
+# Estado completo y actualizaciones para los front-ends (ver cluster.py): las
+# mismas celdas renderizadas que reciben los visores, para todo el campo
+def full_state():
+    return {
+        "version": world.version,
+        "ts": time.time(),
+        "cells": [[x, y, cell] for x, y, cell in rendered_cells((0, 0, FIELD_WIDTH, FIELD_HEIGHT))],
+        "energies": dict(world.energy),
+        "record": record,
+        "remembered": {nick: list(rem) for nick, rem in world.remembered.items()},
+    }
+
+def full_update(changes):
+    body = build_delta(changes, (0, 0, FIELD_WIDTH, FIELD_HEIGHT)) or {}
+    return dict(body, op="update", version=changes.version, ts=changes.time)
+
+async def handle_engine_request(request):
+    # Peticiones de un front-end; devuelve (cabecera, cuerpo binario)
+    op = request["op"]
+    if op == "move":
+        response, dead = await submit_move(request["data"], request["start_energy"], request["binary"])
+        if isinstance(response, bytes):
+            return {"dead": dead}, response
+        return {"response": response, "dead": dead}, b''
+    if op == "leaderboard":
+        return {"response": leaderboard.snapshot(request.get("start_energy"))}, b''
+    if op == "stats":
+        return {"response": await stats()}, b''
+    if op == "metrics":
+        return {"response": registry.collect()}, b''
+    return {"error": f"Unknown op {op}"}, b''
+
+async def engine_request(op, **fields):
+    header, body = await engine_client.request(op, **fields)
+    if "error" in header:
+        raise RuntimeError(header["error"])
+    return header, body
+
+# Expulsión de bots inactivos: los plazos viven en una rueda de temporizadores
+# del motor, así que cada pasada sólo mira los bots cuyo plazo venció
+async def evict_idle_bots():
     while True:
-        await asyncio.sleep(1)
-        if last_bot_request_time is not None:
-            elapsed = time.time() - last_bot_request_time
-            if elapsed > 5 and elapsed <= 10:
-                reset_field()
-                logger.info("Campo reiniciado por inactividad (>5s sin peticiones, habiendo tenido en últimos 10s)")
+        await asyncio.sleep(engine.liveness.tick)
+        evicted = engine.evict_idle()
+        if evicted:
+            bots_evicted.inc(len(evicted))
+            await publish()
+
+# Reglas del juego para un movimiento de un bot (ver engine.py). Devuelve
+# (respuesta, murió). No envía nada: quien llama decide cuándo responder y
+# cuándo publicar. Con binary=True la respuesta (salvo los errores) ya va
+# codificada en binario.
+#
+# {"batch": [movimiento, ...]} aplica los movimientos de varios bots de una vez
+# (una sola versión del mundo y una sola publicación) y responde
+# {"batch": [respuesta, ...]} en el mismo orden. Un lote nunca "muere": los
+# bots muertos reciben su respuesta de muerte dentro del lote.
+def apply_move(data, start_energy=10, binary=False):
+    if isinstance(data, dict) and 'batch' in data:
+        return apply_batch(data['batch'], start_energy, binary), False
+    refused = admission(data)
+    if refused is not None:
+        return refused, False
+    moves_total.inc()
+    return engine.move(data, start_energy, binary)
+
+def apply_batch(moves, start_energy=10, binary=False):
+    if not isinstance(moves, list):
+        return {"error": "Datos inválidos"}
+    if len(moves) > MAX_BATCH:
+        return {"error": f"Lote demasiado grande (máximo {MAX_BATCH})"}
+    # Los movimientos de bots por encima de su límite no llegan al motor
+    refusals = [admission(data) for data in moves]
+    applied = iter(engine.move_batch([data for data, refused in zip(moves, refusals) if refused is None],
+                                     start_energy, binary))
+    results = [next(applied) if refused is None else (refused, False) for refused in refusals]
+    moves_total.inc(refusals.count(None))
+    if binary:
+        return protocol.encode_batch([encode_bot_error(response) if isinstance(response, dict) else response
+                                      for response, _ in results])
+    return {"batch": [response for response, _ in results]}
+
+def apply_tick(calls):
+    # Un tick entero, [(datos, energía inicial, binario)]: los movimientos sueltos
+    # van al motor juntos para calcular su visión en una pasada. Los lotes se
+    # aplican en su sitio, así que antes de cada uno se vacían los sueltos
+    # pendientes y el orden de llegada se mantiene. Nunca lanza: un fallo se
+    # convierte en el error de los movimientos afectados, no de todo el tick.
+    results = []
+    pending = []    # índices de movimientos sueltos aún sin aplicar
+
+    def flush():
+        try:
+            applied = engine.move_many([calls[n] for n in pending])
+        except Exception:
+            logger.exception("Tick moves failed")
+            applied = [({"error": "Error interno"}, False)] * len(pending)
+        for n, result in zip(pending, applied):
+            results[n] = result
+        moves_total.inc(len(pending))
+        pending.clear()
+
+    for data, start_energy, binary in calls:
+        if isinstance(data, dict) and 'batch' in data:
+            flush()
+            try:
+                results.append(apply_move(data, start_energy, binary))
+            except Exception:
+                logger.exception("Tick batch failed")
+                results.append(({"error": "Error interno"}, False))
+            continue
+        refused = admission(data)
+        if refused is not None:
+            results.append((refused, False))
+        else:
+            pending.append(len(results))
+            results.append(None)
+    flush()
+    return results
+
+# --- Control de admisión ---
+
+bot_limiter = RateLimiter(RATE_LIMIT_BOT, RATE_LIMIT_BOT_BURST) if RATE_LIMIT_BOT > 0 else None
+client_limiter = RateLimiter(RATE_LIMIT_CONNECTION, RATE_LIMIT_CONNECTION_BURST) if RATE_LIMIT_CONNECTION > 0 else None
+
+REJECTION_MESSAGES = {
+    ratelimit.RATE_LIMITED: "Demasiados movimientos, espera un poco",
+    ratelimit.COALESCED: "Sustituido por un movimiento posterior",
+    ratelimit.OVERLOADED: "Servidor sobrecargado, reintenta más tarde",
+}
+
+def rejection(code):
+    moves_rejected[code].inc()
+    return {"error": REJECTION_MESSAGES[code], "code": code}
+
+def encode_bot_error(response):
+    return protocol.encode_error(response["error"], response.get("code"))
+
+def admission(data):
+    # Respuesta de rechazo para un movimiento de un cliente, o None si se admite
+    if npcs is not None and isinstance(data, dict) and isinstance(data.get('nickname'), str) \
+            and data['nickname'] in npcs.nicknames:
+        return {"error": "Nickname reservado para un NPC"}
+    if not admit_bot(data):
+        return rejection(ratelimit.RATE_LIMITED)
+    return None
+
+def admit_bot(data):
+    # Límite por nickname; los movimientos sin nickname válido los rechaza el motor
+    if bot_limiter is None or not isinstance(data, dict):
+        return True
+    nickname = data.get('nickname')
+    return not isinstance(nickname, str) or bot_limiter.allow(nickname)
+
+def overloaded():
+    return LOAD_SHED_LAG > 0 and loop_monitor.lag > LOAD_SHED_LAG
+
+scheduler = None
+if TICK_RATE > 0:
+    scheduler = TickScheduler(TICK_RATE, apply_move, publish, TICK_BUDGET_MS / 1000 or None,
+                              apply_tick if engine.vision.vectorized else None)
+    registry.counter("botfield_ticks_total", "Ticks run by the tick engine", lambda: scheduler.ticks)
+    registry.counter("botfield_tick_overruns_total", "Ticks over their time budget", lambda: scheduler.overruns)
+    logger.info("Tick engine enabled at %s Hz", TICK_RATE)
+
+async def submit_move(data, start_energy=10, binary=False):
+    # Con el scheduler activo el movimiento se aplica en el próximo tick (que
+    # también publica); sin él se aplica y se publica al momento. En modo
+    # front-end se reenvía al motor.
+    if engine_client is not None:
+        header, body = await engine_request("move", data=data, start_energy=start_energy, binary=binary)
+        return (body or header["response"]), header["dead"]
+    if scheduler is not None:
+        return await scheduler.submit(data, start_energy, binary)
+    result = apply_move(data, start_energy, binary)
+    await publish()
+    return result
+
+async def submit_engine_step(fn):
+    # Trabajo del motor que no es un movimiento de un cliente (el paso de los
+    # NPC): con el scheduler va dentro del próximo tick, que publica una sola vez
+    if scheduler is not None:
+        return await scheduler.call(fn)
+    result = fn()
+    await publish()
+    return result
+
+async def receive_move(websocket: WebSocket, binary: bool):
+    # Siguiente movimiento (o lote) de un bot; None si no se pudo decodificar
+    # (ya se le respondió con el error)
+    if binary:
+        message = await websocket.receive_bytes()
+        start = time.perf_counter()
+        try:
+            if message[:1] == bytes([protocol.MSG_BATCH]):
+                data = {"batch": [protocol.decode_move(m) for m in protocol.decode_batch(message)]}
+            else:
+                data = protocol.decode_move(message)
+        except (ValueError, struct.error):
+            await send_bot_response(websocket, binary, {"error": "Datos inválidos"})
+            return None
+    else:
+        message = await websocket.receive_text()
+        start = time.perf_counter()
+        data = json.loads(message)
+    stage_seconds["parse"].observe(time.perf_counter() - start)
+    return data
+
+async def send_bot_response(websocket: WebSocket, binary: bool, response):
+    if binary:
+        if isinstance(response, dict):
+            response = encode_bot_error(response)
+        await websocket.send_bytes(response)
+    else:
+        response = json.dumps(response)
+        await websocket.send_text(response)
+    bytes_out["bots"].inc(len(response))
+    messages_out["bots"].inc()
+
+async def coalesce_moves(websocket: WebSocket, binary: bool, bucket: TokenBucket, data):
+    # Espera a que la conexión tenga ficha. Los mensajes que lleguen mientras
+    # tanto sustituyen al pendiente (gana el último), y el sustituido se
+    # responde con el código COALESCED.
+    while not bucket.take():
+        try:
+            newer = await asyncio.wait_for(receive_move(websocket, binary), bucket.wait_time())
+        except asyncio.TimeoutError:
+            continue
+        if newer is not None:
+            await send_bot_response(websocket, binary, rejection(ratelimit.COALESCED))
+            data = newer
+    return data
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     client_info = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else "unknown"
-    logger.debug(f"WebSocket connection attempt to /ws from {client_info}")
-    await websocket.accept()
-    logger.debug(f"WebSocket connection accepted to /ws from {client_info}")
+    binary, subprotocol = negotiate_binary(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    logger.debug("WebSocket connection accepted to /ws from %s (%s)", client_info, 'binary' if binary else 'json')
+    bot_connections.inc()
+    # Límite por conexión: un cubo propio, sin compartir con otras conexiones
+    bucket = TokenBucket(RATE_LIMIT_CONNECTION, RATE_LIMIT_CONNECTION_BURST) if RATE_LIMIT_CONNECTION > 0 else None
     try:
         while True:
-            logger.debug(f"Waiting for message from {client_info}")
-            data = await websocket.receive_json()
-            last_bot_request_time = time.time()
-            logger.debug(f"Received JSON data from {client_info}: {data}")
-            x = data.get('x')
-            y = data.get('y')
-            nickname = data.get('nickname')
-            
-            if not (isinstance(x, int) and isinstance(y, int) and isinstance(nickname, str)):
-                logger.debug(f"Invalid data from {client_info}: {data}")
-                await websocket.send_json({"error": "Datos inválidos"})
+            data = await receive_move(websocket, binary)
+            if data is None:
                 continue
-            
-            if not (0 <= x < 10 and 0 <= y < 10):
-                logger.debug(f"Out of range coordinates from {client_info}: x={x}, y={y}")
-                await websocket.send_json({"error": "Coordenadas fuera de rango 0-9"})
+            logger.debug("Received data from %s: %r", client_info, data)
+            # Admisión antes de las reglas: carga global y ritmo de la conexión
+            if overloaded():
+                await send_bot_response(websocket, binary, rejection(ratelimit.OVERLOADED))
                 continue
+            if bucket is not None:
+                if RATE_LIMIT_MODE == "coalesce":
+                    data = await coalesce_moves(websocket, binary, bucket, data)
+                elif not bucket.take():
+                    await send_bot_response(websocket, binary, rejection(ratelimit.RATE_LIMITED))
+                    continue
             
-            # Asignar color si es nuevo
-            if nickname not in colors:
-                if available_colors:
-                    colors[nickname] = available_colors.pop(0)
-                else:
-                    colors[nickname] = 'WHITE'  # Default si no hay más colores
-                energy[nickname] = 10  # Energía inicial
-                paths[nickname] = [[x, y]]  # Inicializar camino
-                remembered[nickname] = set()  # Inicializar recordadas
-                start_times[nickname] = time.time()
-                start_energies[nickname] = 10
-                logger.info(f"Assigned color {colors[nickname]} to new nickname {nickname} with 10 energy")
-            # Actualizar posición
-            positions[nickname] = (x, y)
-            logger.debug(f"Updated position for {nickname}: ({x}, {y})")
-            
-            # Actualizar camino
-            paths[nickname] = data.get('path', paths.get(nickname, []))
-            
-            # Actualizar comidas recordadas
-            remembered[nickname] = set(tuple(pos) for pos in data.get("remembered", []))
-            
-            consumed = False
-            # Consumir comida objetivo si especificada
-            if 'target_food' in data:
-                tx, ty = data['target_food']
-                for f in list(foods):  # copy to avoid modification during iteration
-                    if isinstance(f, dict) and f['x'] == tx and f['y'] == ty:
-                        foods.remove(f)
-                        energy[nickname] += f['value']
-                        consumed = True
-                        logger.debug(f"{nickname} consumed target food at ({tx}, {ty}), energy +{f['value']}, now {energy[nickname]}")
-                        break
-            
-            # Consumir comida si hay en la posición (por si acaso)
-            for f in list(foods):
-                if isinstance(f, dict) and f['x'] == x and f['y'] == y:
-                    foods.remove(f)
-                    energy[nickname] += f['value']
-                    consumed = True
-                    logger.debug(f"{nickname} consumed food at ({x}, {y}), energy +{f['value']}, now {energy[nickname]}")
-                    break
-            
-            # Perder energía solo si no consumió
-            if not consumed:
-                energy[nickname] -= 1
-            if energy[nickname] <= 0:
-                # Calcular tiempo de vida
-                duration = time.time() - start_times.get(nickname, time.time())
-                start_energy = start_energies.get(nickname, 10)
-                if duration > record["time"]:
-                    record["name"] = nickname
-                    record["time"] = duration
-                    record["date"] = datetime.now().isoformat()
-                    record["start_energy"] = start_energy
-                    with open("records.json", "w") as f:
-                        json.dump(record, f)
-                    logger.info(f"New record: {nickname} survived {duration:.2f} seconds")
-                del positions[nickname]
-                del colors[nickname]
-                del energy[nickname]
-                del paths[nickname]
-                del remembered[nickname]
-                del start_times[nickname]
-                del start_energies[nickname]
-                logger.info(f"{nickname} died due to low energy")
-                # Remover bot del juego
-                del positions[nickname]
-                # Enviar respuesta de muerte
-                response = {"positions": [], "energy": 0}
-                await websocket.send_json(response)
-                # Broadcast el grid actualizado
-                grid_data = {"grid": get_grid(), "energies": dict(energy), "record": record, "remembered": {nick: list(rem) for nick, rem in remembered.items()}}
-                await manager.broadcast(json.dumps(grid_data))
-                break  # Salir del loop para este bot muerto
-            
-            # Calcular las 24 posiciones alrededor en radio 2
-            surroundings = []
-            for dx in range(-2, 3):
-                for dy in range(-2, 3):
-                    if dx == 0 and dy == 0:
-                        continue  # No incluir la posición propia
-                    nx, ny = x + dx, y + dy
-                    if 0 <= nx < 10 and 0 <= ny < 10:
-                        # Verificar si hay un bot en esta posición
-                        occupied = any(pos == (nx, ny) for pos in positions.values())
-                        # Verificar si hay comida
-                        food_here = next((f for f in foods if isinstance(f, dict) and f['x'] == nx and f['y'] == ny), None)
-                        if food_here:
-                            content = {'type': 'food', 'value': food_here['value']}
-                        elif occupied:
-                            content = {'type': 'bot'}
-                        else:
-                            content = None
-                    else:
-                        content = {'type': 'void'}  # Fuera del mapa
-                    surroundings.append({'x': nx, 'y': ny, 'content': content})
+            response, dead = await submit_move(data, 10, binary)  # Energía inicial 10
             
             # Enviar respuesta
-            response = {"positions": surroundings, "energy": energy[nickname]}
-            logger.debug(f"Sending response to {client_info}")
-            await websocket.send_json(response)
-            logger.debug(f"Response sent to {client_info}")
-            
-            # Broadcast el grid actualizado a los clientes web
-            grid_data = {"grid": get_grid(), "energies": dict(energy), "record": record, "remembered": {nick: list(rem) for nick, rem in remembered.items()}}
-            logger.debug(f"Broadcasting grid update: {len(manager.active_connections)} connections")
-            await manager.broadcast(json.dumps(grid_data))
-    except Exception as e:
-        import traceback
-        logger.debug(f"Error in WebSocket /ws from {client_info}: {e}")
-        print(traceback.format_exc())
-        print(f"Error: {e}")
+            await send_bot_response(websocket, binary, response)
+            if dead:
+                break  # Salir del loop para este bot muerto
+    except Exception:
+        logger.debug("Error in WebSocket /ws from %s", client_info, exc_info=True)
+    finally:
+        bot_connections.dec()
+
+def parse_subscription(request):
+    # {"type": "subscribe", "topics": [...], "bots": [...]}; sin "topics", todos
+    # los temas, y sin "bots" (o null), las comidas recordadas de todos los bots.
+    # Devuelve (temas, bots); ValueError/TypeError si no es válida.
+    topics = request.get("topics")
+    topics = TOPICS if topics is None else frozenset(topics)
+    if not topics <= TOPICS:
+        raise ValueError(f"Unknown topics {sorted(topics - TOPICS)}")
+    if topics == TOPICS:
+        topics = TOPICS  # La misma instancia: select_topics no copia nada
+    bots = request.get("bots")
+    if bots is not None:
+        if not isinstance(bots, list) or not all(isinstance(b, str) for b in bots):
+            raise TypeError("bots must be a list of nicknames")
+        bots = frozenset(bots)
+    return topics, bots
 
 @app.websocket("/ws/web")
 async def websocket_web(websocket: WebSocket):
     client_info = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else "unknown"
-    logger.debug(f"WebSocket connection attempt to /ws/web from {client_info}")
-    await websocket.accept()
-    await manager.connect(websocket)
-    logger.debug(f"WebSocket connection accepted to /ws/web from {client_info}. Total connections: {len(manager.active_connections)}")
+    binary, subprotocol = negotiate_binary(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    await manager.connect(websocket, binary)
     try:
         while True:
-            logger.debug(f"Waiting for message from /ws/web client {client_info}")
             message = await websocket.receive_text()
-            logger.debug(f"Received text message from /ws/web client {client_info}: {message}")
+            # Suscripción a un viewport ({"viewport": {"x", "y", "w", "h"}}),
+            # a unos temas ({"type": "subscribe", ...}) o petición de snapshot
+            # tras detectar un salto de versión ({"type": "resync"})
+            try:
+                request = json.loads(message)
+                if request.get("type") == "resync":
+                    await manager.send_snapshot(websocket)
+                    continue
+                if request.get("type") == "subscribe":
+                    await manager.subscribe(websocket, *parse_subscription(request))
+                    continue
+                viewport = request["viewport"]
+                viewport = tuple(int(viewport[k]) for k in ("x", "y", "w", "h"))
+            except (ValueError, TypeError, KeyError, AttributeError):
+                logger.debug("Ignoring message from /ws/web client %s: %r", client_info, message)
+                continue
+            await manager.set_viewport(websocket, viewport)
     except Exception as e:
-        logger.debug(f"Error in WebSocket /ws/web from {client_info}: {e}")
+        logger.debug("Error in WebSocket /ws/web from %s: %s", client_info, e)
         manager.disconnect(websocket)
-        logger.debug(f"Disconnected /ws/web client {client_info}. Total connections: {len(manager.active_connections)}")
+
+# Reproducción de partidas grabadas en el registro de eventos, con el mismo
+# protocolo que /ws/web. Parámetros: segment (por defecto el más antiguo
+# conservado), speed (multiplicador; 0 = lo más rápido posible) y start
+# (segundos desde el inicio del segmento). Sigue por los segmentos posteriores
+# hasta llegar al final del log.
+@app.websocket("/ws/replay")
+async def websocket_replay(websocket: WebSocket):
+    client_info = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else "unknown"
+    binary, subprotocol = negotiate_binary(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    segments = eventlog.list_segments(EVENTLOG_DIR) if EVENTLOG_DIR else []
+    params = websocket.query_params
+    try:
+        segment = int(params["segment"]) if "segment" in params else segments[0]
+        speed = float(params.get("speed", "1"))
+        start = float(params.get("start", "0"))
+        if segment not in segments or speed < 0:
+            raise ValueError(segment)
+    except (ValueError, IndexError):
+        logger.debug("Invalid replay request from %s: %s", client_info, params)
+        await websocket.close(code=1008)
+        return
+    logger.info("Replaying from segment %d at x%s for %s", segment, speed, client_info)
+
+    viewport = [clamp_viewport(DEFAULT_VIEWPORT)]
+    subscription = [TOPICS, None]   # (temas, bots)
+    resync = asyncio.Event()
+    resync.set()
+
+    async def receive():
+        # Mismos mensajes que /ws/web: cambio de viewport, suscripción o resync
+        while True:
+            message = await websocket.receive_text()
+            try:
+                request = json.loads(message)
+                if request.get("type") == "subscribe":
+                    subscription[:] = parse_subscription(request)
+                elif request.get("type") != "resync":
+                    viewport[0] = clamp_viewport(tuple(int(request["viewport"][k]) for k in ("x", "y", "w", "h")))
+            except (ValueError, TypeError, KeyError, AttributeError):
+                continue
+            resync.set()
+
+    async def send(message):
+        if binary:
+            await websocket.send_bytes(protocol.encode_snapshot(message) if message["type"] == "snapshot"
+                                       else protocol.encode_delta(message))
+        else:
+            await websocket.send_text(json.dumps(message))
+
+    receiver = asyncio.create_task(receive())
+    try:
+        loop = asyncio.get_running_loop()
+        source = World(FIELD_WIDTH, FIELD_HEIGHT, TRAIL_LENGTH)
+        origin = None   # hora de la grabación al inicio del primer segmento
+        clock = None    # (hora de la grabación, hora real) del primer envío
+        sent = 0        # última versión enviada
+        for current in segments[segments.index(segment):]:
+            state = await asyncio.to_thread(eventlog.load_snapshot, eventlog.segment_path(EVENTLOG_DIR, current, "snap"))
+            source.restore(state)
+            if origin is None:
+                origin = state.get("time", 0.0)
+            for count, event in enumerate(eventlog.read_events(eventlog.segment_path(EVENTLOG_DIR, current, "log"))):
+                if receiver.done():
+                    return  # El visor se desconectó
+                changes = eventlog.apply_event(source, event)
+                if changes is None or changes.time - origin < start:
+                    if count % 1000 == 999:
+                        await asyncio.sleep(0)  # No bloquear el loop al avanzar rápido
+                    continue
+                if speed > 0:
+                    if clock is None:
+                        clock = (changes.time, loop.time())
+                    await asyncio.sleep(max(0.0, clock[1] + (changes.time - clock[0]) / speed - loop.time()))
+                else:
+                    await asyncio.sleep(0)
+                if resync.is_set() or changes.full:
+                    resync.clear()
+                    await send(select_topics(build_snapshot(viewport[0], source), *subscription))
+                    sent = source.version
+                    continue
+                body = build_delta(changes, viewport[0], source)
+                if body is not None:
+                    body = select_topics(body, *subscription)
+                if body:
+                    await send({"type": "delta", "version": changes.version, "base": sent, "ts": changes.time, **body})
+                    sent = changes.version
+        if resync.is_set():
+            await send(select_topics(build_snapshot(viewport[0], source), *subscription))
+        logger.info("Replay finished for %s", client_info)
+        await websocket.close()
+    except Exception as e:
+        logger.debug("Replay for %s stopped: %s", client_info, e)
+    finally:
+        receiver.cancel()
+
+@app.get("/replays")
+async def list_replays():
+    # Segmentos del registro de eventos que se pueden reproducir
+    if not EVENTLOG_DIR:
+        return []
+    result = []
+    for segment in eventlog.list_segments(EVENTLOG_DIR):
+        try:
+            result.append({
+                "segment": segment,
+                "started": os.path.getmtime(eventlog.segment_path(EVENTLOG_DIR, segment, "snap")),
+                "log_bytes": os.path.getsize(eventlog.segment_path(EVENTLOG_DIR, segment, "log")),
+            })
+        except OSError:
+            continue  # Borrado mientras se listaba
+    return result
 
 @app.post("/ws")
 async def http_ws_endpoint(request: Request):
-    client_info = f"{request.client.host}:{request.client.port}" if request.client else "unknown"
-    logger.debug(f"HTTP POST to /ws from {client_info}")
+    # Admisión antes de las reglas: carga global y ritmo por dirección de cliente
+    if overloaded():
+        return JSONResponse(rejection(ratelimit.OVERLOADED), status_code=503)
+    if client_limiter is not None and not client_limiter.allow(request.client.host if request.client else None):
+        return JSONResponse(rejection(ratelimit.RATE_LIMITED), status_code=429)
     try:
         data = await request.json()
-        last_bot_request_time = time.time()
-        logger.debug(f"POST /ws body: {data}")
-        
-        x = data.get('x')
-        y = data.get('y')
-        nickname = data.get('nickname')
-        
-        if not (isinstance(x, int) and isinstance(y, int) and isinstance(nickname, str)):
-            logger.debug(f"Invalid data from {client_info}: {data}")
-            return {"error": "Datos inválidos"}
-        
-        if not (0 <= x < 10 and 0 <= y < 10):
-            logger.debug(f"Out of range coordinates from {client_info}: x={x}, y={y}")
-            return {"error": "Coordenadas fuera de rango 0-9"}
-        
-        # Asignar color si es nuevo
-        if nickname not in colors:
-            if available_colors:
-                colors[nickname] = available_colors.pop(0)
-            else:
-                colors[nickname] = 'WHITE'  # Default si no hay más colores
-            energy[nickname] = 30  # Energía inicial
-            paths[nickname] = [[x, y]]  # Inicializar camino
-            logger.info(f"Assigned color {colors[nickname]} to new nickname {nickname} with 30 energy")
-        
-        # Actualizar posición
-        positions[nickname] = (x, y)
-        logger.debug(f"Updated position for {nickname}: ({x}, {y})")
-        
-        # Actualizar camino
-        paths[nickname] = data.get('path', paths.get(nickname, []))
-        
-        consumed = False
-        # Consumir comida si hay
-        for f in list(foods):
-            if isinstance(f, dict) and f['x'] == x and f['y'] == y:
-                foods.remove(f)
-                energy[nickname] += f['value']
-                consumed = True
-                logger.debug(f"{nickname} consumed food at ({x}, {y}), energy +{f['value']}, now {energy[nickname]}")
-                break
-        
-        # Perder energía solo si no consumió
-        if not consumed:
-            energy[nickname] -= 1
-        if energy[nickname] <= 0:
-            del positions[nickname]
-            del colors[nickname]
-            del energy[nickname]
-            del paths[nickname]
-            logger.info(f"{nickname} died due to low energy")
-            # No broadcast aquí, ya que se hará después
-        
-        # Calcular las 24 posiciones alrededor en radio 2
-        surroundings = []
-        for dx in range(-2, 3):
-            for dy in range(-2, 3):
-                if dx == 0 and dy == 0:
-                    continue  # No incluir la posición propia
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < 10 and 0 <= ny < 10:
-                    # Verificar si hay un bot en esta posición
-                    occupied = any(pos == (nx, ny) for pos in positions.values())
-                    # Verificar si hay comida
-                    food_here = next((f for f in foods if isinstance(f, dict) and f['x'] == nx and f['y'] == ny), None)
-                    if food_here:
-                        content = {'type': 'food', 'value': food_here['value']}
-                    elif occupied:
-                        content = {'type': 'bot'}
-                    else:
-                        content = None
-                else:
-                    content = {'type': 'void'}  # Fuera del mapa
-                surroundings.append({'x': nx, 'y': ny, 'content': content})
-        
-        # Enviar respuesta
-        response = {"positions": surroundings, "energy": energy[nickname]}
-        logger.debug(f"Sending response to {client_info}")
-        
-        # Broadcast el grid actualizado a los clientes web
-        grid_data = {"grid": get_grid(), "energies": dict(energy)}
-        logger.debug(f"Broadcasting grid update: {len(manager.active_connections)} connections")
-        await manager.broadcast(json.dumps(grid_data))
+        logger.debug("POST /ws body: %r", data)
         
+        response, dead = await submit_move(data, 30)  # Energía inicial 30
         return response
     except Exception as e:
-        logger.debug(f"Error parsing POST /ws from {client_info}: {e}")
+        logger.debug("Error parsing POST /ws from %s: %s", request.client, e)
         return {"error": "Invalid JSON"}
 
+@app.get("/leaderboard")
+async def get_leaderboard(start_energy: Optional[int] = None):
+    # Se sirve desde memoria, sin tocar el disco
+    if engine_client is not None:
+        header, _ = await engine_request("leaderboard", start_energy=start_energy)
+        return header["response"]
+    return leaderboard.snapshot(start_energy)
+
+@app.get("/stats")
+async def stats():
+    # Contadores internos: caché de mensajes, visores, ticks
+    if engine_client is not None:
+        header, _ = await engine_request("stats")
+        return {
+            "worker": os.getpid(),
+            "version": replica.version,
+            "viewers": len(manager.viewers),
+            "slow_viewer_disconnects": manager.slow_disconnects,
+            "viewer_queue_overflows": manager.overflows,
+            "payload_cache": payloads.stats(),
+            "engine": header["response"],
+        }
+    data = {
+        "version": world.version,
+        "bots": len(world.positions),
+        "viewers": len(manager.viewers),
+        "slow_viewer_disconnects": manager.slow_disconnects,
+        "viewer_queue_overflows": manager.overflows,
+        "payload_cache": payloads.stats(),
+    }
+    if scheduler is not None:
+        data["tick"] = {
+            "rate": TICK_RATE,
+            "ticks": scheduler.ticks,
+            "overruns": scheduler.overruns,
+            "last_batch": scheduler.last_batch,
+            "last_duration_ms": scheduler.last_duration * 1000,
+            "max_duration_ms": scheduler.max_duration * 1000,
+        }
+    if npcs is not None:
+        data["npc"] = {
+            "count": len(npcs.nicknames),
+            "steps": npcs.steps,
+            "deaths": npcs.deaths,
+            "last_duration_ms": npcs.last_duration * 1000,
+        }
+    return data
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Formato de texto de Prometheus. En modo front-end se añaden las métricas
+    # del motor (reglas, visión, ticks...) con process="engine"
+    if engine_client is not None:
+        header, _ = await engine_request("metrics")
+        text = metrics.render(registry.collect(process="frontend", worker=str(os.getpid())),
+                              [[name, kind, help, [[suffix, dict(labels, process="engine"), value]
+                                                   for suffix, labels, value in samples]]
+                               for name, kind, help, samples in header["response"]])
+    else:
+        text = metrics.render(registry.collect())
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
 @app.get("/", response_class=HTMLResponse)
 async def get(request: Request):
-    client_info = f"{request.client.host}:{request.client.port}" if request.client else "unknown"
-    logger.debug(f"Serving index.html to {client_info}")
-    return templates.TemplateResponse("index.html", {"request": request})
+    view_w, view_h = DEFAULT_VIEWPORT[2], DEFAULT_VIEWPORT[3]
+    return templates.TemplateResponse(request, "index.html", {
+        "width": FIELD_WIDTH,
+        "height": FIELD_HEIGHT,
+        "view_w": view_w,
+        "view_h": view_h,
+        "cell_px": 40 if max(view_w, view_h) <= 16 else max(8, 640 // max(view_w, view_h)),
+    })
 
 if __name__ == "__main__":
     import uvicorn
@@ -433,12 +1084,10 @@ if __name__ == "__main__":
     
     async def main():
         # Inicializar comida
-        global foods
-        foods = [f for f in foods if isinstance(f, dict)] + [{'x': random.randint(0,9), 'y': random.randint(0,9), 'value':5} for _ in range(10)]
+        engine.scatter_food(10)
         
         # Lanzar tasks
         asyncio.create_task(regenerate_food())
-        asyncio.create_task(monitor_activity())
         
         config = uvicorn.Config(app, host="0.0.0.0", port=8000, log_level="warning")
         server = uvicorn.Server(config)
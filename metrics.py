@@ -0,0 +1,140 @@
+import asyncio
+import bisect
+import math
+
+# Métricas en memoria con formato de texto de Prometheus. Contadores,
+# indicadores e histogramas de latencia con cubos fijos: observar un valor es
+# una búsqueda binaria y una suma, así que se puede usar en el camino caliente.
+# Cada métrica es una serie (nombre + etiquetas); las series con el mismo
+# nombre forman una familia y se muestran juntas en /metrics.
+
+# Cubos de latencia en segundos (10 µs .. 1 s)
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+           0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Counter:
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn    # fn() -> valor, para contadores que ya lleva otro objeto
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, labels):
+        return [["", labels, self.fn() if self.fn is not None else self.value]]
+
+
+class Gauge:
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self, labels):
+        return [["", labels, self.fn() if self.fn is not None else self.value]]
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, labels):
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            result.append(["_bucket", dict(labels, le=format_value(bound)), total])
+        result.append(["_sum", labels, self.sum])
+        result.append(["_count", labels, self.count])
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}  # nombre: [tipo, ayuda, [(etiquetas, métrica)]]
+
+    def _add(self, kind, name, help, metric, labels):
+        family = self.families.setdefault(name, [kind, help, []])
+        family[2].append((labels, metric))
+        return metric
+
+    def counter(self, name, help, fn=None, **labels):
+        return self._add("counter", name, help, Counter(fn), labels)
+
+    def gauge(self, name, help, fn=None, **labels):
+        return self._add("gauge", name, help, Gauge(fn), labels)
+
+    def histogram(self, name, help, buckets=BUCKETS, **labels):
+        return self._add("histogram", name, help, Histogram(buckets), labels)
+
+    def collect(self, **extra):
+        # Familias serializables (para juntar las de varios procesos):
+        # [[nombre, tipo, ayuda, [[sufijo, etiquetas, valor], ...]], ...]
+        return [[name, kind, help, [sample for labels, metric in series
+                                    for sample in metric.samples(dict(labels, **extra))]]
+                for name, (kind, help, series) in self.families.items()]
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def render(*collections):
+    # Texto de Prometheus; une las familias con el mismo nombre
+    families = {}
+    for collection in collections:
+        for name, kind, help, samples in collection:
+            family = families.setdefault(name, [kind, help, []])
+            family[2].extend(samples)
+    lines = []
+    for name, (kind, help, samples) in families.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            if labels:
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f"{name}{suffix}{{{label_text}}} {format_value(value)}")
+            else:
+                lines.append(f"{name}{suffix} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Retraso del event loop: una tarea duerme interval segundos y mide cuánto más
+# tarda en despertar. Si el loop está ocupado (un tick largo, un snapshot
+# grande...) todo lo demás espera lo mismo.
+class LoopMonitor:
+    def __init__(self, histogram, interval=0.25):
+        self.histogram = histogram
+        self.interval = interval
+        self.lag = 0.0      # último retraso medido (segundos)
+        self.max_lag = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            self.histogram.observe(self.lag)
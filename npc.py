@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import protocol
+from bot import Strategy
+
+logger = logging.getLogger(__name__)
+
+
+# Bots del servidor (NPC) con la estrategia de bot.py, sin sockets: cada paso
+# aplica los movimientos de todos los NPC en un lote del motor (una versión del
+# mundo y las visiones en una pasada) y después cada estrategia elige su
+# siguiente movimiento. Las estrategias se reparten en shards, uno por worker,
+# que se quedan donde se crearon: con NPC_POOL=process cada shard vive en su
+# propio proceso y sólo viajan las respuestas en binario (ver protocol.py) y los
+# movimientos siguientes; con hilos, fuera del event loop pero sin paralelismo
+# real por el GIL. Los NPC que mueren se sustituyen por otros nuevos con el
+# mismo nickname, así que la población se mantiene.
+class Shard:
+    def __init__(self, nicknames, width, height, seed):
+        self.width = width
+        self.height = height
+        self.rng = random.Random(seed)
+        self.strategies = [self._spawn(nickname) for nickname in nicknames]
+
+    def _spawn(self, nickname):
+        return Strategy(nickname, width=self.width, height=self.height,
+                        rng=random.Random(self.rng.random()), verbose=False)
+
+    def advance(self, responses=None):
+        # responses: respuesta binaria de cada NPC, o None si murió (se sustituye).
+        # Devuelve los movimientos siguientes.
+        if responses is not None:
+            for n, response in enumerate(responses):
+                strategy = self.strategies[n]
+                if response is None:
+                    self.strategies[n] = self._spawn(strategy.nickname)
+                else:
+                    strategy.update(protocol.decode_response(response, strategy.x, strategy.y))
+        return [strategy.message() for strategy in self.strategies]
+
+
+# Shard del proceso worker (NPC_POOL=process)
+_shard = None
+
+
+def _init_shard(*args):
+    global _shard
+    _shard = Shard(*args)
+
+
+def _advance_shard(responses):
+    return _shard.advance(responses)
+
+
+class NpcPool:
+    def __init__(self, engine, count, prefix="npc", interval=2.0, workers=0, processes=False,
+                 start_energy=10, rng=None):
+        self.engine = engine
+        self.interval = interval        # segundos entre pasos (el sleep de bot.py)
+        self.start_energy = start_energy
+        rng = rng or random.Random()
+        world = engine.world
+        nicknames = [f"{prefix}{i}" for i in range(count)]
+        self.nicknames = set(nicknames)
+        # Un shard por worker (0 = uno solo, en el event loop)
+        size = -(-count // max(workers, 1))
+        parts = [(nicknames[i:i + size], world.width, world.height, rng.random())
+                 for i in range(0, count, size)]
+        self.shards = []
+        self.executors = []
+        if processes and workers > 0:
+            self.executors = [ProcessPoolExecutor(1, initializer=_init_shard, initargs=part) for part in parts]
+        else:
+            self.shards = [Shard(*part) for part in parts]
+            if workers > 0:
+                self.executors = [ThreadPoolExecutor(workers)]
+        self.sizes = [len(part[0]) for part in parts]
+        self.messages = None    # próximos movimientos de todos los NPC, en orden
+        self.task = None
+
+        # Estadísticas
+        self.steps = 0
+        self.deaths = 0
+        self.last_duration = 0.0
+
+    def step(self):
+        # Aplica un movimiento de cada NPC; devuelve sus respuestas (None para
+        # los que murieron)
+        results = self.engine.move_many([(data, self.start_energy, True) for data in self.messages])
+        responses = []
+        for response, dead in results:
+            if dead or isinstance(response, dict):
+                self.deaths += dead
+                response = None
+            responses.append(response)
+        return responses
+
+    async def advance(self, responses=None):
+        # Cada shard elige los movimientos siguientes de sus NPC
+        parts = []
+        start = 0
+        for size in self.sizes:
+            parts.append(None if responses is None else responses[start:start + size])
+            start += size
+        if not self.executors:
+            messages = [shard.advance(part) for shard, part in zip(self.shards, parts)]
+        else:
+            loop = asyncio.get_running_loop()
+            if self.shards:
+                calls = [loop.run_in_executor(self.executors[0], shard.advance, part)
+                         for shard, part in zip(self.shards, parts)]
+            else:
+                calls = [loop.run_in_executor(executor, _advance_shard, part)
+                         for executor, part in zip(self.executors, parts)]
+            messages = await asyncio.gather(*calls)
+        self.messages = [data for part in messages for data in part]
+
+    def start(self, submit, paused=None):
+        # submit: corrutina submit(fn) que ejecuta fn() sobre el mundo (p. ej.
+        # dentro del próximo tick), publica y devuelve su resultado.
+        # paused: fn() -> True para saltarse el paso (p. ej. con el servidor sobrecargado)
+        self.task = asyncio.create_task(self.run(submit, paused))
+
+    async def run(self, submit, paused=None):
+        loop = asyncio.get_running_loop()
+        await self.advance()
+        next_step = loop.time()
+        while True:
+            next_step += self.interval
+            await asyncio.sleep(max(0.0, next_step - loop.time()))
+            if loop.time() - next_step > self.interval:
+                next_step = loop.time()
+            if paused is not None and paused():
+                continue
+            start = time.perf_counter()
+            try:
+                responses = await submit(self.step)
+                await self.advance(responses)
+            except Exception:
+                logger.exception("NPC step failed")
+            self.steps += 1
+            self.last_duration = time.perf_counter() - start
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,194 @@
+import json
+import struct
+
+# Protocolo binario opcional para /ws y /ws/web. Se negocia con el subprotocolo
+# "botfield.bin" o con ?proto=bin en la URL; sin eso se sigue usando JSON.
+# Todos los enteros son little-endian.
+SUBPROTOCOL = "botfield.bin"
+
+# Códigos de celda en la visión de un bot
+CELL_EMPTY = 0
+CELL_FOOD = 1
+CELL_BOT = 2
+CELL_VOID = 3
+
+# Tipos de mensaje
+MSG_MOVE = 1       # bot -> servidor
+MSG_VISION = 1     # servidor -> bot: bot vivo, con su visión
+MSG_DEAD = 2       # servidor -> bot: el bot murió
+MSG_BATCH = 3      # ambos sentidos: varios movimientos o respuestas en un mensaje
+MSG_ERROR = 0xFF   # servidor -> bot: error (texto utf-8)
+MSG_SNAPSHOT = 1   # servidor -> visor
+MSG_DELTA = 2      # servidor -> visor
+
+# Flags del movimiento
+FLAG_TARGET = 1
+FLAG_REMEMBERED = 2
+
+# Tipos de celda en los mensajes de visor
+KIND_EMPTY = 0
+KIND_FOOD = 1
+KIND_BOT = 2
+KIND_TRAIL = 3
+
+# Índices de color en los mensajes de visor (mismo orden que world.COLORS)
+COLOR_NAMES = ['RED', 'GREEN', 'BLUE', 'YELLOW', 'MAGENTA', 'CYAN', 'TEAL', 'WHITE']
+COLOR_INDEX = {name: i for i, name in enumerate(COLOR_NAMES)}
+
+MOVE_HEADER = struct.Struct('<BiiBB')    # tipo, x, y, flags, longitud del nickname
+POINT = struct.Struct('<ii')
+COUNT = struct.Struct('<H')
+VISION_HEADER = struct.Struct('<BiB')    # tipo, energía, radio
+SNAPSHOT_HEADER = struct.Struct('<BIIIHH')  # tipo, versión, viewport x, y, w, h
+DELTA_HEADER = struct.Struct('<BII')     # tipo, versión, base
+CELL_RECORD = struct.Struct('<IIBBI')    # x, y, tipo, color, valor
+LENGTH = struct.Struct('<I')
+
+
+def vision_size(radius):
+    side = 2 * radius + 1
+    return side * side - 1
+
+
+# --- Bots ---
+
+def encode_move(data):
+    nickname = data['nickname'].encode('utf-8')
+    flags = 0
+    tail = b''
+    if 'target_food' in data:
+        flags |= FLAG_TARGET
+        tail += POINT.pack(*data['target_food'])
+    if 'remembered' in data:
+        flags |= FLAG_REMEMBERED
+        remembered = list(data['remembered'])
+        tail += COUNT.pack(len(remembered)) + b''.join(POINT.pack(px, py) for px, py in remembered)
+    return MOVE_HEADER.pack(MSG_MOVE, data['x'], data['y'], flags, len(nickname)) + nickname + tail
+
+
+def decode_move(message):
+    # Devuelve el mismo dict que enviaría un cliente JSON
+    kind, x, y, flags, length = MOVE_HEADER.unpack_from(message)
+    if kind != MSG_MOVE:
+        raise ValueError(f"unexpected message type {kind}")
+    offset = MOVE_HEADER.size
+    data = {'x': x, 'y': y, 'nickname': message[offset:offset + length].decode('utf-8')}
+    offset += length
+    if flags & FLAG_TARGET:
+        data['target_food'] = list(POINT.unpack_from(message, offset))
+        offset += POINT.size
+    if flags & FLAG_REMEMBERED:
+        (count,) = COUNT.unpack_from(message, offset)
+        offset += COUNT.size
+        data['remembered'] = [list(POINT.unpack_from(message, offset + i * POINT.size)) for i in range(count)]
+    return data
+
+
+def encode_vision(energy, radius, codes, values):
+    # codes: bytes con un código por celda; values: array('H') con el valor de comida
+    return VISION_HEADER.pack(MSG_VISION, energy, radius) + bytes(codes) + values.tobytes()
+
+
+def encode_dead():
+    return VISION_HEADER.pack(MSG_DEAD, 0, 0)
+
+
+def encode_batch(messages):
+    # Lote: tipo y número de mensajes, cada uno precedido de su longitud
+    return (bytes([MSG_BATCH]) + COUNT.pack(len(messages))
+            + b''.join(LENGTH.pack(len(m)) + m for m in messages))
+
+
+def decode_batch(message):
+    if message[0] != MSG_BATCH:
+        raise ValueError(f"unexpected message type {message[0]}")
+    (count,) = COUNT.unpack_from(message, 1)
+    offset = 1 + COUNT.size
+    messages = []
+    for _ in range(count):
+        (length,) = LENGTH.unpack_from(message, offset)
+        offset += LENGTH.size
+        if offset + length > len(message):
+            raise ValueError("truncated batch")
+        messages.append(bytes(message[offset:offset + length]))
+        offset += length
+    return messages
+
+
+def encode_error(message, code=None):
+    # Con código (p. ej. "rate_limited") el texto es "código\0mensaje"
+    if code is not None:
+        message = f"{code}\0{message}"
+    return bytes([MSG_ERROR]) + message.encode('utf-8')
+
+
+def decode_response(message, x, y):
+    # Convierte una respuesta binaria al dict JSON equivalente, dadas las
+    # coordenadas desde las que se movió el bot
+    if message[0] == MSG_ERROR:
+        text = message[1:].decode('utf-8')
+        if "\0" in text:
+            code, text = text.split("\0", 1)
+            return {"error": text, "code": code}
+        return {"error": text}
+    kind, energy, radius = VISION_HEADER.unpack_from(message)
+    if kind == MSG_DEAD:
+        return {"positions": [], "energy": 0}
+    n = vision_size(radius)
+    codes = message[VISION_HEADER.size:VISION_HEADER.size + n]
+    values = struct.unpack_from(f'<{n}H', message, VISION_HEADER.size + n)
+    positions = []
+    i = 0
+    for dx in range(-radius, radius + 1):
+        for dy in range(-radius, radius + 1):
+            if dx == 0 and dy == 0:
+                continue
+            code = codes[i]
+            if code == CELL_FOOD:
+                content = {'type': 'food', 'value': values[i]}
+            elif code == CELL_BOT:
+                content = {'type': 'bot'}
+            elif code == CELL_VOID:
+                content = {'type': 'void'}
+            else:
+                content = None
+            positions.append({'x': x + dx, 'y': y + dy, 'content': content})
+            i += 1
+    return {"positions": positions, "energy": energy}
+
+
+# --- Visores ---
+
+def _cell_record(x, y, cell):
+    if cell == '.':
+        return CELL_RECORD.pack(x, y, KIND_EMPTY, 0, 0)
+    if isinstance(cell, str):
+        return CELL_RECORD.pack(x, y, KIND_FOOD, 0, 0)
+    color = cell['color']
+    if not cell['symbol']:
+        return CELL_RECORD.pack(x, y, KIND_TRAIL, COLOR_INDEX.get(color[:-4], 0), 0)
+    return CELL_RECORD.pack(x, y, KIND_BOT, COLOR_INDEX.get(color, 0), ord(cell['symbol'][0]))
+
+
+def _tail(message):
+    # Energías, récord, comidas recordadas y hora del cambio van como JSON al
+    # final del mensaje
+    extra = {k: message[k] for k in ('energies', 'record', 'remembered', 'ts') if k in message}
+    payload = json.dumps(extra).encode('utf-8') if extra else b''
+    return LENGTH.pack(len(payload)) + payload
+
+
+def encode_snapshot(snapshot):
+    viewport = snapshot['viewport']
+    x0, y0 = viewport['x'], viewport['y']
+    records = [_cell_record(x0 + x, y0 + y, cell)
+               for y, row in enumerate(snapshot.get('grid', ()))
+               for x, cell in enumerate(row) if cell != '.']
+    header = SNAPSHOT_HEADER.pack(MSG_SNAPSHOT, snapshot['version'], x0, y0, viewport['w'], viewport['h'])
+    return header + LENGTH.pack(len(records)) + b''.join(records) + _tail(snapshot)
+
+
+def encode_delta(delta):
+    records = [_cell_record(x, y, cell) for x, y, cell in delta.get('cells', ())]
+    header = DELTA_HEADER.pack(MSG_DELTA, delta['version'], delta['base'])
+    return header + LENGTH.pack(len(records)) + b''.join(records) + _tail(delta)
@@ -0,0 +1,70 @@
+import time
+
+# Límites de ritmo con cubos de fichas (token bucket): cada cubo se rellena a
+# rate fichas por segundo hasta burst, y cada mensaje o movimiento gasta una.
+# El relleno se calcula al consultar, sin tareas ni temporizadores.
+
+# Códigos de error de los movimientos rechazados
+RATE_LIMITED = "rate_limited"   # el bot o la conexión superó su límite
+COALESCED = "coalesced"         # sustituido por un movimiento posterior de la misma conexión
+OVERLOADED = "overloaded"       # el servidor está descartando carga
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'last')
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate        # fichas por segundo
+        self.burst = burst      # fichas máximas
+        self.tokens = burst
+        self.last = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.last:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+    def take(self, now=None, cost=1):
+        # Gasta cost fichas si las hay; devuelve si se pudo
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def wait_time(self, now=None, cost=1):
+        # Segundos hasta que haya cost fichas
+        self._refill(time.monotonic() if now is None else now)
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+
+# Un cubo por clave (nickname, dirección del cliente...). Los cubos que ya se
+# rellenaron del todo se descartan de vez en cuando: empezar de nuevo con un
+# cubo lleno es lo mismo.
+class RateLimiter:
+    def __init__(self, rate, burst, prune_interval=10.0):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.prune_interval = prune_interval
+        self.last_prune = time.monotonic()
+        self.rejected = 0
+
+    def allow(self, key, now=None, cost=1):
+        if now is None:
+            now = time.monotonic()
+        if now - self.last_prune > self.prune_interval:
+            self.prune(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+        if bucket.take(now, cost):
+            return True
+        self.rejected += 1
+        return False
+
+    def prune(self, now):
+        self.last_prune = now
+        full = self.burst / self.rate   # segundos para rellenar un cubo vacío
+        for key in [key for key, bucket in self.buckets.items() if now - bucket.last >= full]:
+            del self.buckets[key]
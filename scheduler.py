@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Motor de ticks a frecuencia fija: los movimientos de los bots se encolan según
+# llegan y se aplican en lote una vez por tick, seguidos de una única
+# publicación para los visores. Cada submit devuelve un futuro que se resuelve
+# con el resultado de apply cuando se procesa su tick. Con apply_many, el tick
+# entero se aplica en una sola llamada (p. ej. para calcular la visión de todos
+# los bots de una vez).
+class TickScheduler:
+    def __init__(self, rate, apply, publish, budget=None, apply_many=None):
+        self.interval = 1.0 / rate
+        self.budget = budget if budget is not None else self.interval  # segundos por tick
+        self.apply = apply      # fn(*args) -> resultado (síncrona)
+        self.apply_many = apply_many    # fn([args, ...]) -> [resultado, ...]
+        self.publish = publish  # corrutina sin argumentos
+        self.pending = []       # [(args, futuro)]
+        self.calls = []         # [(fn, futuro)]: trabajo del motor para el próximo tick
+
+        # Estadísticas
+        self.ticks = 0
+        self.overruns = 0       # ticks que superaron el presupuesto
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.last_batch = 0
+
+    def submit(self, *args):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((args, future))
+        return future
+
+    def call(self, fn):
+        # Ejecuta fn() en el próximo tick, tras los movimientos y antes de
+        # publicar (p. ej. el paso de los NPC); el futuro se resuelve con su resultado
+        future = asyncio.get_running_loop().create_future()
+        self.calls.append((fn, future))
+        return future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.interval
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            try:
+                await self.tick()
+            except Exception:
+                # Un tick fallido no puede parar el motor: los siguientes submit esperarían para siempre
+                logger.exception("Tick %d failed", self.ticks + 1)
+            # Si vamos más de un tick por detrás, no intentar recuperar los perdidos
+            if loop.time() - next_tick > self.interval:
+                next_tick = loop.time()
+
+    async def tick(self):
+        start = time.perf_counter()
+        batch, self.pending = self.pending, []
+        if self.apply_many is not None:
+            live = [(args, future) for args, future in batch if not future.cancelled()]
+            try:
+                results = self.apply_many([args for args, _ in live])
+            except Exception as e:
+                for _, future in live:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(live, results):
+                    future.set_result(result)
+        else:
+            for args, future in batch:
+                if future.cancelled():
+                    continue  # El cliente se desconectó mientras esperaba
+                try:
+                    future.set_result(self.apply(*args))
+                except Exception as e:
+                    future.set_exception(e)
+        calls, self.calls = self.calls, []
+        for fn, future in calls:
+            if future.cancelled():
+                continue
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+        try:
+            await self.publish()
+        except Exception:
+            # Los futuros del lote ya están resueltos; los visores recibirán el próximo tick
+            logger.exception("Publish failed in tick %d", self.ticks + 1)
+
+        duration = time.perf_counter() - start
+        self.ticks += 1
+        self.last_batch = len(batch)
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        if duration > self.budget:
+            self.overruns += 1
+            logger.warning(f"Tick {self.ticks} took {duration * 1000:.1f} ms for {len(batch)} moves "
+                           f"(budget {self.budget * 1000:.1f} ms, {self.overruns} overruns)")
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bot import Strategy
+from engine import Engine
+from world import World
+
+# Simulación sin red: juega partidas completas con la estrategia de bot.py
+# contra las reglas de engine.py, avanzando el tiempo por ticks en lugar de
+# esperar. Cada tick todos los bots vivos hacen un movimiento; un tick equivale
+# a STEP_SECONDS del juego real (el sleep de bot.py), así que las duraciones
+# son comparables con las de records.json.
+STEP_SECONDS = 2.0
+FOOD_INTERVAL = 35.0    # segundos de juego entre regeneraciones (como en main.py)
+
+
+def play(seed, bots=1, width=10, height=10, food=15, max_ticks=100000):
+    rng = random.Random(seed)
+    world = World(width, height)
+    now = 0.0
+    survival = []
+    engine = Engine(world, clock=lambda: now, rng=rng,
+                    on_death=lambda nickname, duration, start_energy: survival.append(duration))
+    engine.seed_food(food)
+
+    names = ["orion"] if bots == 1 else [f"orion{i}" for i in range(bots)]
+    alive = [Strategy(name, width=width, height=height, rng=random.Random(rng.random()), verbose=False)
+             for name in names]
+    next_food = FOOD_INTERVAL
+    ticks = 0
+    moves = 0
+    while alive and ticks < max_ticks:
+        survivors = []
+        for strategy in alive:
+            response, dead = engine.move(strategy.message())
+            moves += 1
+            if not dead:
+                strategy.update(response)
+                survivors.append(strategy)
+        alive = survivors
+        # El mundo se usa sin visores: descartar los cambios acumulados
+        world.commit()
+        ticks += 1
+        now = ticks * STEP_SECONDS
+        while now >= next_food:
+            engine.spawn_food()
+            next_food += FOOD_INTERVAL
+    return {"seed": seed, "ticks": ticks, "moves": moves, "survival": survival, "alive": len(alive)}
+
+
+def _play(args):
+    return play(*args)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulación de partidas sin servidor")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--bots", type=int, default=1, help="bots por partida")
+    parser.add_argument("--seed", type=int, default=0, help="semilla de la primera partida")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--width", type=int, default=int(os.getenv("FIELD_WIDTH", "10")))
+    parser.add_argument("--height", type=int, default=int(os.getenv("FIELD_HEIGHT", "10")))
+    parser.add_argument("--food", type=int, default=15, help="comida inicial")
+    parser.add_argument("--max-ticks", type=int, default=100000)
+    parser.add_argument("--json", help="guardar resultados en este fichero")
+    args = parser.parse_args()
+
+    jobs = [(args.seed + i, args.bots, args.width, args.height, args.food, args.max_ticks)
+            for i in range(args.games)]
+    start = time.perf_counter()
+    if args.workers > 1:
+        with ProcessPoolExecutor(args.workers) as pool:
+            results = list(pool.map(_play, jobs, chunksize=max(1, len(jobs) // (args.workers * 4))))
+    else:
+        results = [_play(job) for job in jobs]
+    elapsed = time.perf_counter() - start
+
+    ticks = sum(r["ticks"] for r in results)
+    moves = sum(r["moves"] for r in results)
+    survival = [s for r in results for s in r["survival"]]
+    censored = sum(r["alive"] for r in results)
+
+    summary = {
+        "games": len(results),
+        "elapsed": elapsed,
+        "ticks": ticks,
+        "ticks_per_second": ticks / elapsed if elapsed else 0.0,
+        "moves_per_second": moves / elapsed if elapsed else 0.0,
+        "deaths": len(survival),
+        "alive_at_max_ticks": censored,
+        "survival": {
+            "mean": statistics.fmean(survival) if survival else 0.0,
+            "min": min(survival, default=0.0),
+            "p25": percentile(survival, 25),
+            "p50": percentile(survival, 50),
+            "p75": percentile(survival, 75),
+            "p90": percentile(survival, 90),
+            "p99": percentile(survival, 99),
+            "max": max(survival, default=0.0),
+        },
+    }
+
+    print(f"{summary['games']} partidas, {ticks} ticks en {elapsed:.2f} s "
+          f"({summary['ticks_per_second']:.0f} ticks/s, {summary['moves_per_second']:.0f} movimientos/s)")
+    print(f"Muertes: {len(survival)}, vivos al llegar a --max-ticks: {censored}")
+    print("Supervivencia (s): " + ", ".join(f"{k} {v:.1f}" for k, v in summary["survival"].items()))
+    if survival:
+        # Histograma en 10 tramos
+        top = max(survival)
+        width = top / 10 or 1.0
+        counts = [0] * 10
+        for s in survival:
+            counts[min(int(s / width), 9)] += 1
+        scale = max(counts)
+        for i, count in enumerate(counts):
+            print(f"{i * width:8.0f}-{(i + 1) * width:<8.0f} {count:6d} {'#' * round(40 * count / scale)}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(summary, results=results), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Rueda de temporizadores (hashed timer wheel): cada clave tiene un plazo y
+# vive en la ranura del tick en que vence. Programar, reprogramar y cancelar
+# son O(1), y avanzar sólo recorre las ranuras de los ticks transcurridos, así
+# que el coste es proporcional a lo que vence y no al número de claves. Los
+# plazos a más de una vuelta de la rueda se quedan en su ranura y se saltan
+# hasta la vuelta en que vencen. La precisión es de un tick.
+class TimerWheel:
+    def __init__(self, tick=1.0, slots=64, now=0.0):
+        self.tick = tick                          # segundos por ranura
+        self.slots = [{} for _ in range(slots)]   # ranura: {clave: plazo}
+        self.entries = {}                         # clave: (plazo, ranura)
+        self.done = int(now // tick) - 1          # último tick ya recorrido entero
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def schedule(self, key, deadline):
+        # Programa (o reprograma) la clave para que venza en deadline. Un plazo
+        # en un tick ya recorrido va al siguiente, para no esperar una vuelta.
+        old = self.entries.get(key)
+        if old is not None:
+            del self.slots[old[1]][key]
+        index = max(int(deadline // self.tick), self.done + 1) % len(self.slots)
+        self.entries[key] = (deadline, index)
+        self.slots[index][key] = deadline
+
+    def cancel(self, key):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            del self.slots[old[1]][key]
+
+    def advance(self, now):
+        # Recorre los ticks que terminaron antes de now y devuelve las claves
+        # vencidas (ya quitadas de la rueda)
+        target = int(now // self.tick) - 1
+        if target <= self.done:
+            return []
+        # Tras una pausa larga basta con una vuelta: todas las ranuras
+        first = max(self.done + 1, target - len(self.slots) + 1)
+        self.done = target
+        expired = []
+        for t in range(first, target + 1):
+            slot = self.slots[t % len(self.slots)]
+            if not slot:
+                continue
+            for key, deadline in list(slot.items()):
+                if deadline <= now:
+                    del slot[key]
+                    del self.entries[key]
+                    expired.append(key)
+        return expired
@@ -0,0 +1,140 @@
+import logging
+from array import array
+
+import protocol
+from protocol import CELL_BOT, CELL_EMPTY, CELL_FOOD, CELL_VOID
+from world import CHUNK_MASK, CHUNK_SHIFT, CHUNK_SIZE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# Contenidos constantes de la visión (se comparten entre respuestas)
+VOID = {'type': 'void'}
+BOT = {'type': 'bot'}
+CONTENTS = {CELL_EMPTY: None, CELL_BOT: BOT, CELL_VOID: VOID}
+
+
+# Visión de los bots: las celdas en un radio alrededor del bot (sin la suya),
+# por columnas (dx y luego dy), en el orden de siempre. Las celdas de fuera del
+# campo dependen sólo de la distancia del bot a cada borde (hasta el radio), así
+# que para cada una de esas clases de borde se precalcula una vez la tabla de
+# desplazamientos que caen dentro y una plantilla de códigos con las de fuera ya
+# marcadas como vacío. Lejos de los bordes todos los bots usan la misma tabla:
+# ver es copiar la plantilla y mirar el chunk de cada celda de la tabla, sin
+# comprobar límites.
+#
+# Con vectorized=True (requiere numpy) see_many calcula la visión de todos los
+# bots de un lote o tick en una pasada sobre los chunks que se ven.
+class Vision:
+    def __init__(self, world, radius=2, vectorized=False):
+        self.world = world
+        self.radius = radius
+        self.size = protocol.vision_size(radius)
+        self.offsets = [(dx, dy) for dx in range(-radius, radius + 1)
+                        for dy in range(-radius, radius + 1) if dx or dy]
+        self.tables = {}    # clase de borde: (desplazamientos dentro, plantilla de códigos)
+        self.no_values = array('H', bytes(2 * self.size))
+        if vectorized and numpy is None:
+            logger.warning("numpy is not installed: using scalar vision")
+            vectorized = False
+        self.vectorized = vectorized
+        if vectorized:
+            self.dx = numpy.array([dx for dx, _ in self.offsets], dtype=numpy.int64)
+            self.dy = numpy.array([dy for _, dy in self.offsets], dtype=numpy.int64)
+
+    def _table(self, x, y):
+        r = self.radius
+        world = self.world
+        key = (min(x, r), min(world.width - 1 - x, r), min(y, r), min(world.height - 1 - y, r))
+        table = self.tables.get(key)
+        if table is None:
+            left, right, top, bottom = key
+            inside = []
+            codes = bytearray(self.size)
+            for n, (dx, dy) in enumerate(self.offsets):
+                if -left <= dx <= right and -top <= dy <= bottom:
+                    inside.append((n, dx, dy))
+                else:
+                    codes[n] = CELL_VOID
+            table = self.tables[key] = (inside, bytes(codes))
+        return table
+
+    def see(self, x, y):
+        # Un código y un valor de comida por celda (bytearray, array('H'))
+        inside, template = self._table(x, y)
+        codes = bytearray(template)
+        values = array('H', self.no_values)
+        chunks, cols = self.world.chunks, self.world.chunk_cols
+        last_key = -1
+        chunk = None
+        for n, dx, dy in inside:
+            nx = x + dx
+            ny = y + dy
+            # Las celdas seguidas de una columna suelen caer en el mismo chunk
+            key = (ny >> CHUNK_SHIFT) * cols + (nx >> CHUNK_SHIFT)
+            if key != last_key:
+                chunk = chunks.get(key)
+                last_key = key
+            if chunk is not None:
+                i = ((ny & CHUNK_MASK) << CHUNK_SHIFT) | (nx & CHUNK_MASK)
+                value = chunk.food[i]
+                if value:
+                    codes[n] = CELL_FOOD
+                    values[n] = value
+                elif chunk.bots[i]:
+                    codes[n] = CELL_BOT
+        return codes, values
+
+    def see_many(self, points):
+        # Visiones de varios bots [(x, y)], en el mismo orden
+        if self.vectorized and len(points) > 1:
+            return self._see_many_numpy(points)
+        return [self.see(x, y) for x, y in points]
+
+    def _see_many_numpy(self, points):
+        world = self.world
+        p = numpy.array(points, dtype=numpy.int64)
+        nx = p[:, :1] + self.dx     # bots x celdas
+        ny = p[:, 1:] + self.dy
+        inside = (nx >= 0) & (nx < world.width) & (ny >= 0) & (ny < world.height)
+        nx = numpy.where(inside, nx, 0)
+        ny = numpy.where(inside, ny, 0)
+        # Apilar sólo los chunks que se ven (uno vacío si no está reservado)
+        keys, slots = numpy.unique((ny >> CHUNK_SHIFT) * world.chunk_cols + (nx >> CHUNK_SHIFT),
+                                   return_inverse=True)
+        food = numpy.zeros((len(keys), CHUNK_SIZE * CHUNK_SIZE), dtype=numpy.uint16)
+        bots = numpy.zeros((len(keys), CHUNK_SIZE * CHUNK_SIZE), dtype=numpy.int32)
+        for k, key in enumerate(keys.tolist()):
+            chunk = world.chunks.get(key)
+            if chunk is not None:
+                food[k] = numpy.frombuffer(chunk.food, dtype=numpy.uint16)
+                bots[k] = numpy.frombuffer(chunk.bots, dtype=numpy.int32)
+        slots = slots.reshape(nx.shape)
+        cells = ((ny & CHUNK_MASK) << CHUNK_SHIFT) | (nx & CHUNK_MASK)
+        values = numpy.where(inside, food[slots, cells], 0).astype(numpy.uint16)
+        codes = numpy.select([~inside, values > 0, bots[slots, cells] != 0],
+                             [CELL_VOID, CELL_FOOD, CELL_BOT], CELL_EMPTY).astype(numpy.uint8)
+        codes = codes.tobytes()
+        values = values.tobytes()
+        n = self.size
+        views = []
+        for b in range(len(points)):
+            row = array('H')
+            row.frombytes(values[2 * n * b:2 * n * (b + 1)])
+            views.append((codes[n * b:n * (b + 1)], row))
+        return views
+
+    def response(self, x, y, energy, codes, values, binary=False):
+        # Respuesta para el bot en (x, y): binaria o {"positions", "energy"}
+        if binary:
+            return protocol.encode_vision(energy, self.radius, codes, values)
+        positions = []
+        for n, (dx, dy) in enumerate(self.offsets):
+            code = codes[n]
+            content = {'type': 'food', 'value': values[n]} if code == CELL_FOOD else CONTENTS[code]
+            positions.append({'x': x + dx, 'y': y + dy, 'content': content})
+        return {"positions": positions, "energy": energy}
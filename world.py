@@ -0,0 +1,557 @@
+import time
+from array import array
+
+# Colores disponibles para los bots, en orden de asignación
+COLORS = ['RED', 'GREEN', 'BLUE', 'YELLOW', 'MAGENTA', 'CYAN', 'TEAL', 'WHITE']
+
+# El campo se divide en chunks de CHUNK_SIZE x CHUNK_SIZE celdas que sólo se
+# reservan cuando contienen algo, así la memoria crece con el área ocupada y no
+# con ancho x alto.
+CHUNK_SHIFT = 4
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+
+
+# Cambios aplicados al mundo entre dos versiones consecutivas
+class Changes:
+    __slots__ = ('version', 'cells', 'energies', 'remembered', 'record', 'full', 'time')
+
+    def __init__(self, version, cells, energies, remembered, record, full):
+        self.version = version
+        self.time = time.time()       # momento del commit (segundos epoch)
+        self.cells = cells            # set of (x, y) cuyo contenido cambió
+        self.energies = energies      # set of nicknames cuya energía cambió (o que murieron)
+        self.remembered = remembered  # set of nicknames cuyas comidas recordadas cambiaron
+        self.record = record          # True si cambió el récord
+        self.full = full              # True si el campo entero cambió (reinicio)
+
+
+class Chunk:
+    __slots__ = ('bots', 'food', 'trail', 'trail_owner', 'used')
+
+    def __init__(self):
+        n = CHUNK_SIZE * CHUNK_SIZE
+        self.bots = array('i', [0]) * n          # celda: id de bot (0 = vacía)
+        self.food = array('H', [0]) * n          # celda: valor de comida (0 = sin comida)
+        self.trail = array('I', [0]) * n         # celda: entradas de rastros que pasan por ella
+        self.trail_owner = array('i', [0]) * n   # celda: id del último bot que dejó rastro
+        self.used = 0                            # celdas con bot, comida o rastro
+
+
+# Rastro de un bot: buffer circular de capacidad fija con las últimas celdas
+# visitadas, empaquetadas como y * ancho + x
+class Trail:
+    __slots__ = ('cells', 'head', 'size')
+
+    def __init__(self, capacity):
+        self.cells = array('I', [0]) * capacity
+        self.head = 0   # posición de la próxima escritura
+        self.size = 0
+
+    def last(self):
+        if not self.size:
+            return None
+        return self.cells[self.head - 1]
+
+    def push(self, cell):
+        # Añade una celda; devuelve la que sale del buffer (None si no salió ninguna)
+        capacity = len(self.cells)
+        dropped = self.cells[self.head] if self.size == capacity else None
+        self.cells[self.head] = cell
+        self.head = (self.head + 1) % capacity
+        self.size = min(self.size + 1, capacity)
+        return dropped
+
+    def __iter__(self):
+        capacity = len(self.cells)
+        start = self.head - self.size
+        for k in range(self.size):
+            yield self.cells[(start + k) % capacity]
+
+
+# Celdas libres (sin bot ni comida) con selección aleatoria en O(1). Es una
+# permutación virtual de todas las celdas en la que las primeras count son las
+# libres; ocupar o liberar una celda la intercambia con la frontera. Sólo se
+# guardan las posiciones que no coinciden con la identidad (Fisher-Yates
+# disperso), así que la memoria crece con las celdas ocupadas y no con el campo.
+class FreeCells:
+    __slots__ = ('size', 'count', '_at', '_index')
+
+    def __init__(self, size):
+        self.size = size
+        self.count = size   # celdas libres: posiciones [0, count)
+        self._at = {}       # posición: celda (cuando no es la identidad)
+        self._index = {}    # celda: posición (cuando no es la identidad)
+
+    def __len__(self):
+        return self.count
+
+    def _set(self, pos, cell):
+        if pos == cell:
+            self._at.pop(pos, None)
+            self._index.pop(cell, None)
+        else:
+            self._at[pos] = cell
+            self._index[cell] = pos
+
+    def _swap(self, i, j):
+        ci, cj = self._at.get(i, i), self._at.get(j, j)
+        self._set(i, cj)
+        self._set(j, ci)
+
+    def occupy(self, cell):
+        i = self._index.get(cell, cell)
+        if i < self.count:
+            self.count -= 1
+            self._swap(i, self.count)
+
+    def release(self, cell):
+        i = self._index.get(cell, cell)
+        if i >= self.count:
+            self._swap(i, self.count)
+            self.count += 1
+
+    def sample(self, rng):
+        # Celda libre al azar (None si no queda ninguna)
+        if not self.count:
+            return None
+        i = rng.randrange(self.count)
+        return self._at.get(i, i)
+
+    def clear(self):
+        self.count = self.size
+        self._at.clear()
+        self._index.clear()
+
+
+# Estado del campo respaldado por chunks de arrays. Los mapas inversos permiten
+# ir de nickname a celda y de celda a nickname en O(1).
+class World:
+    def __init__(self, width=10, height=10, trail_length=10):
+        self.width = width
+        self.height = height
+        self.trail_length = trail_length  # celdas de rastro por bot (0 = sin rastro)
+        self.chunk_cols = (width + CHUNK_MASK) >> CHUNK_SHIFT
+        self.chunk_rows = (height + CHUNK_MASK) >> CHUNK_SHIFT
+        self.chunks = {}         # clave de chunk: Chunk
+        self.food_cells = set()  # celdas con comida
+        self.free = FreeCells(width * height)  # celdas sin bot ni comida
+        self.regions = []        # [(x0, y0, x1, y1, FreeCells)]: celdas libres por región (add_region)
+        self._shared = {}        # celda: [ids] cuando hay más de un bot en la misma celda
+
+        # Versión del mundo y cambios pendientes desde la última versión
+        self.version = 0
+        self._cells = set()
+        self._energies = set()
+        self._remembered = set()
+        self._record = False
+        self._full = False
+
+        self.positions = {}      # nickname: (x, y)
+        self.bot_ids = {}        # nickname: id
+        self.nicknames = {}      # id: nickname
+        self.colors = {}         # nickname: color_name
+        self.energy = {}         # nickname: int
+        self.trails = {}         # nickname: Trail
+        self.remembered = {}     # nickname: set of (x, y)
+        self.start_times = {}    # nickname: start_time
+        self.start_energies = {} # nickname: start_energy
+        self.available_colors = list(COLORS)
+        self._next_id = 1
+        self.events = None       # registro de eventos (eventlog.EventLog) o None
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def cell(self, x, y):
+        return y * self.width + x
+
+    def chunk_key(self, x, y):
+        return (y >> CHUNK_SHIFT) * self.chunk_cols + (x >> CHUNK_SHIFT)
+
+    def chunk_keys(self, x0, y0, w, h):
+        # Claves de los chunks que cubren el rectángulo (recortado al campo)
+        x1 = min(x0 + w, self.width) - 1
+        y1 = min(y0 + h, self.height) - 1
+        x0, y0 = max(x0, 0), max(y0, 0)
+        if x1 < x0 or y1 < y0:
+            return set()
+        return {cy * self.chunk_cols + cx
+                for cy in range(y0 >> CHUNK_SHIFT, (y1 >> CHUNK_SHIFT) + 1)
+                for cx in range(x0 >> CHUNK_SHIFT, (x1 >> CHUNK_SHIFT) + 1)}
+
+    def commit(self):
+        # Cierra los cambios pendientes en una nueva versión (None si no hubo cambios)
+        if not (self._cells or self._energies or self._remembered or self._record or self._full):
+            return None
+        self.version += 1
+        changes = Changes(self.version, self._cells, self._energies, self._remembered, self._record, self._full)
+        if self.events is not None:
+            self.events.commit(self.version, changes.time)
+        self._cells, self._energies, self._remembered = set(), set(), set()
+        self._record = self._full = False
+        return changes
+
+    def mark_record(self):
+        self._record = True
+
+    def _chunk(self, x, y):
+        key = (y >> CHUNK_SHIFT) * self.chunk_cols + (x >> CHUNK_SHIFT)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = Chunk()
+        self._cells.add((x, y))
+        return key, chunk, ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+
+    def _release(self, key, chunk):
+        if not chunk.used:
+            del self.chunks[key]
+
+    # --- Comida ---
+
+    def food_at(self, x, y):
+        chunk = self.chunks.get((y >> CHUNK_SHIFT) * self.chunk_cols + (x >> CHUNK_SHIFT))
+        if chunk is None:
+            return 0
+        return chunk.food[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)]
+
+    def add_food(self, x, y, value=5):
+        if self.food_at(x, y):
+            return False
+        key, chunk, i = self._chunk(x, y)
+        if not (chunk.bots[i] or chunk.trail[i]):
+            chunk.used += 1
+        if not chunk.bots[i]:
+            self._occupy(x, y)
+        chunk.food[i] = value
+        self.food_cells.add(y * self.width + x)
+        if self.events is not None:
+            self.events.food(x, y, value)
+        return True
+
+    def take_food(self, x, y):
+        # Consume la comida de la celda y devuelve su valor (0 si no había)
+        if not self.food_at(x, y):
+            return 0
+        key, chunk, i = self._chunk(x, y)
+        value = chunk.food[i]
+        chunk.food[i] = 0
+        if not chunk.bots[i]:
+            self._vacate(x, y)
+        if not (chunk.bots[i] or chunk.trail[i]):
+            chunk.used -= 1
+            self._release(key, chunk)
+        self.food_cells.discard(y * self.width + x)
+        if self.events is not None:
+            self.events.take(x, y)
+        return value
+
+    def foods(self):
+        w = self.width
+        return [{'x': c % w, 'y': c // w, 'value': self.food_at(c % w, c // w)} for c in self.food_cells]
+
+    # --- Bots ---
+
+    def bot_at(self, x, y):
+        chunk = self.chunks.get((y >> CHUNK_SHIFT) * self.chunk_cols + (x >> CHUNK_SHIFT))
+        if chunk is None:
+            return None
+        bot_id = chunk.bots[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)]
+        return self.nicknames.get(bot_id) if bot_id else None
+
+    def is_free(self, x, y):
+        chunk = self.chunks.get((y >> CHUNK_SHIFT) * self.chunk_cols + (x >> CHUNK_SHIFT))
+        if chunk is None:
+            return True
+        i = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        return not chunk.bots[i] and not chunk.food[i]
+
+    def random_free_cell(self, rng, region=None):
+        # (x, y) de una celda libre al azar, en todo el campo o en una región de
+        # add_region; None si no queda ninguna
+        if region is None:
+            c = self.free.sample(rng)
+            if c is None:
+                return None
+            return c % self.width, c // self.width
+        x0, y0, x1, y1, free = self.regions[region]
+        c = free.sample(rng)
+        if c is None:
+            return None
+        return x0 + c % (x1 - x0), y0 + c // (x1 - x0)
+
+    def free_in_region(self, region):
+        return len(self.regions[region][4])
+
+    def add_region(self, x, y, w, h):
+        # Mantiene también el índice de celdas libres del rectángulo (recortado
+        # al campo); devuelve su número, o None si queda vacío
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(self.width, x + w), min(self.height, y + h)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        free = FreeCells((x1 - x0) * (y1 - y0))
+        occupied = [(c % self.width, c // self.width) for c in self.food_cells]
+        occupied.extend(self.positions.values())
+        for cx, cy in occupied:
+            if x0 <= cx < x1 and y0 <= cy < y1:
+                free.occupy((cy - y0) * (x1 - x0) + (cx - x0))
+        self.regions.append((x0, y0, x1, y1, free))
+        return len(self.regions) - 1
+
+    def _occupy(self, x, y):
+        self.free.occupy(y * self.width + x)
+        for x0, y0, x1, y1, free in self.regions:
+            if x0 <= x < x1 and y0 <= y < y1:
+                free.occupy((y - y0) * (x1 - x0) + (x - x0))
+
+    def _vacate(self, x, y):
+        self.free.release(y * self.width + x)
+        for x0, y0, x1, y1, free in self.regions:
+            if x0 <= x < x1 and y0 <= y < y1:
+                free.release((y - y0) * (x1 - x0) + (x - x0))
+
+    def add_bot(self, nickname, x, y, start_energy, now):
+        if self.available_colors:
+            self.colors[nickname] = self.available_colors.pop(0)
+        else:
+            self.colors[nickname] = 'WHITE'  # Default si no hay más colores
+        bot_id = self._next_id
+        self._next_id += 1
+        self.bot_ids[nickname] = bot_id
+        self.nicknames[bot_id] = nickname
+        self.energy[nickname] = start_energy
+        self._energies.add(nickname)
+        if self.trail_length > 0:
+            self.trails[nickname] = Trail(self.trail_length)
+        self.remembered[nickname] = set()
+        self.start_times[nickname] = now
+        self.start_energies[nickname] = start_energy
+        if self.events is not None:
+            self.events.join(bot_id, nickname, x, y, start_energy, now)
+
+    def set_energy(self, nickname, value):
+        if self.energy[nickname] != value:
+            self.energy[nickname] = value
+            self._energies.add(nickname)
+            if self.events is not None:
+                self.events.energy(self.bot_ids[nickname], value)
+
+    def set_remembered(self, nickname, cells):
+        if self.remembered.get(nickname) != cells:
+            self.remembered[nickname] = cells
+            self._remembered.add(nickname)
+            if self.events is not None:
+                self.events.remembered(self.bot_ids[nickname], cells)
+
+    def trail_at(self, x, y):
+        # Número de entradas de rastros que pasan por la celda
+        chunk = self.chunks.get((y >> CHUNK_SHIFT) * self.chunk_cols + (x >> CHUNK_SHIFT))
+        if chunk is None:
+            return 0
+        return chunk.trail[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)]
+
+    def trail_owner(self, x, y):
+        # Nickname del último bot que dejó rastro en la celda (None si no hay rastro)
+        chunk = self.chunks.get((y >> CHUNK_SHIFT) * self.chunk_cols + (x >> CHUNK_SHIFT))
+        if chunk is None:
+            return None
+        i = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        if not chunk.trail[i]:
+            return None
+        return self.nicknames.get(chunk.trail_owner[i])
+
+    def move_bot(self, nickname, x, y):
+        old = self.positions.get(nickname)
+        if old is not None:
+            self._unplace(self.bot_ids[nickname], old[0], old[1])
+        self._place(self.bot_ids[nickname], x, y)
+        self.positions[nickname] = (x, y)
+        if self.events is not None:
+            self.events.move(self.bot_ids[nickname], x, y)
+        trail = self.trails.get(nickname)
+        if trail is not None:
+            c = y * self.width + x
+            if trail.last() != c:  # Quedarse quieto no borra el rastro
+                dropped = trail.push(c)
+                self._add_trail(self.bot_ids[nickname], x, y)
+                if dropped is not None:
+                    self._drop_trail(dropped % self.width, dropped // self.width)
+
+    def remove_bot(self, nickname):
+        pos = self.positions.pop(nickname, None)
+        bot_id = self.bot_ids.pop(nickname)
+        if self.events is not None:
+            self.events.leave(bot_id)
+        if pos is not None:
+            self._unplace(bot_id, pos[0], pos[1])
+        trail = self.trails.pop(nickname, None)
+        if trail is not None:
+            for c in trail:
+                self._drop_trail(c % self.width, c // self.width)
+        del self.nicknames[bot_id]
+        # El color vuelve a estar disponible para el próximo bot
+        color = self.colors.pop(nickname)
+        if color in COLORS and color not in self.available_colors:
+            self.available_colors.append(color)
+        del self.energy[nickname]
+        self._energies.add(nickname)
+        if self.remembered.pop(nickname, None):
+            self._remembered.add(nickname)
+        self.start_times.pop(nickname, None)
+        self.start_energies.pop(nickname, None)
+
+    def _place(self, bot_id, x, y):
+        key, chunk, i = self._chunk(x, y)
+        current = chunk.bots[i]
+        if current:
+            self._shared.setdefault(y * self.width + x, [current]).append(bot_id)
+        else:
+            if not (chunk.food[i] or chunk.trail[i]):
+                chunk.used += 1
+            if not chunk.food[i]:
+                self._occupy(x, y)
+        chunk.bots[i] = bot_id
+
+    def _unplace(self, bot_id, x, y):
+        key, chunk, i = self._chunk(x, y)
+        c = y * self.width + x
+        stack = self._shared.get(c)
+        if stack is not None:
+            stack.remove(bot_id)
+            chunk.bots[i] = stack[-1]
+            if len(stack) == 1:
+                del self._shared[c]
+            return
+        chunk.bots[i] = 0
+        if not chunk.food[i]:
+            self._vacate(x, y)
+        if not (chunk.food[i] or chunk.trail[i]):
+            chunk.used -= 1
+            self._release(key, chunk)
+
+    def _add_trail(self, bot_id, x, y):
+        key, chunk, i = self._chunk(x, y)
+        if not (chunk.bots[i] or chunk.food[i] or chunk.trail[i]):
+            chunk.used += 1
+        chunk.trail[i] += 1
+        chunk.trail_owner[i] = bot_id
+
+    def _drop_trail(self, x, y):
+        key = (y >> CHUNK_SHIFT) * self.chunk_cols + (x >> CHUNK_SHIFT)
+        chunk = self.chunks[key]
+        i = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        chunk.trail[i] -= 1
+        if chunk.trail[i]:
+            return  # Otros rastros siguen pasando por la celda
+        chunk.trail_owner[i] = 0
+        self._cells.add((x, y))
+        if not (chunk.bots[i] or chunk.food[i]):
+            chunk.used -= 1
+            self._release(key, chunk)
+
+    # --- Consultas ---
+
+    def cells_in(self, x0, y0, w, h):
+        # Celdas no vacías dentro del rectángulo:
+        # (x, y, nickname o None, comida, dueño del rastro o None)
+        x1 = min(x0 + w, self.width)
+        y1 = min(y0 + h, self.height)
+        for key in self.chunk_keys(x0, y0, w, h):
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                continue
+            bx = (key % self.chunk_cols) << CHUNK_SHIFT
+            by = (key // self.chunk_cols) << CHUNK_SHIFT
+            bots, food, trail, owners = chunk.bots, chunk.food, chunk.trail, chunk.trail_owner
+            for y in range(max(by, y0), min(by + CHUNK_SIZE, y1)):
+                row = (y & CHUNK_MASK) << CHUNK_SHIFT
+                for x in range(max(bx, x0), min(bx + CHUNK_SIZE, x1)):
+                    i = row | (x & CHUNK_MASK)
+                    if bots[i] or food[i] or trail[i]:
+                        yield (x, y, self.nicknames.get(bots[i]), food[i],
+                               self.nicknames.get(owners[i]) if trail[i] else None)
+
+    def reset(self):
+        if self.events is not None:
+            self.events.reset()
+        self._full = True
+        self._cells.clear()
+        self._energies.clear()
+        self._remembered.clear()
+        self.chunks.clear()
+        self.food_cells.clear()
+        self.free.clear()
+        for region in self.regions:
+            region[4].clear()
+        self._shared.clear()
+        self.positions.clear()
+        self.bot_ids.clear()
+        self.nicknames.clear()
+        self.colors.clear()
+        self.energy.clear()
+        self.trails.clear()
+        self.remembered.clear()
+        self.start_times.clear()
+        self.start_energies.clear()
+        self.available_colors = list(COLORS)
+
+    # --- Snapshots ---
+
+    def state(self):
+        # Estado completo como dict serializable en JSON
+        bots = []
+        for nickname, bot_id in self.bot_ids.items():
+            trail = self.trails.get(nickname)
+            bots.append({
+                "nickname": nickname,
+                "id": bot_id,
+                "position": self.positions.get(nickname),
+                "color": self.colors[nickname],
+                "energy": self.energy[nickname],
+                "remembered": sorted(self.remembered.get(nickname, ())),
+                "start_time": self.start_times.get(nickname),
+                "start_energy": self.start_energies.get(nickname),
+                "trail": list(trail) if trail is not None else [],
+            })
+        w = self.width
+        return {
+            "width": self.width,
+            "height": self.height,
+            "version": self.version,
+            "next_id": self._next_id,
+            "available_colors": list(self.available_colors),
+            "food": [[c % w, c // w, self.food_at(c % w, c // w)] for c in self.food_cells],
+            "bots": bots,
+        }
+
+    def restore(self, state):
+        # Sustituye el estado por el de state() sin registrar eventos
+        events, self.events = self.events, None
+        self.reset()
+        for x, y, value in state["food"]:
+            self.add_food(x, y, value)
+        for bot in state["bots"]:
+            nickname, bot_id = bot["nickname"], bot["id"]
+            self.bot_ids[nickname] = bot_id
+            self.nicknames[bot_id] = nickname
+            self.colors[nickname] = bot["color"]
+            self.energy[nickname] = bot["energy"]
+            self.remembered[nickname] = {tuple(p) for p in bot["remembered"]}
+            self.start_times[nickname] = bot["start_time"]
+            self.start_energies[nickname] = bot["start_energy"]
+            if self.trail_length > 0:
+                trail = self.trails[nickname] = Trail(self.trail_length)
+                for c in bot["trail"][-self.trail_length:]:
+                    trail.push(c)
+                    self._add_trail(bot_id, c % self.width, c // self.width)
+            if bot["position"] is not None:
+                x, y = bot["position"]
+                self._place(bot_id, x, y)
+                self.positions[nickname] = (x, y)
+        self.version = state["version"]
+        self._next_id = state["next_id"]
+        self.available_colors = list(state["available_colors"])
+        self._cells, self._energies, self._remembered = set(), set(), set()
+        self._record = self._full = False
+        self.events = events